@@ -1,94 +1,120 @@
-import shutil
-import json
-import threading
 import time
+from startup_timing import StartupTimer
+
+# Started before the other imports so the startup report includes them
+startup_timer = StartupTimer()
+
+import json
 import os
-import re
+import sqlite3
 from datetime import datetime
 import tkinter as tk
 from tkinter import messagebox, scrolledtext, ttk
-from pynput import mouse, keyboard
-from selenium import webdriver
-import pyautogui
 from pathlib import Path
-from tkcalendar import Calendar
+import metrics
+from action_list import ActionListView
+from recording_format import BINARY_EXTENSION, RecordingReader, write_recording
+from capture_buffer import CaptureBuffer, event_to_action
+from replay_timing import MODE_FIXED, REPLAY_MODES
+from path_simplify import MoveSimplifier
+from screen_wait import AUTO_WAIT_PAUSE, FingerprintRecorder
+from visual_anchor import ANCHOR_EXTENSION, AnchorSet, PatchRecorder, VisualLocator, anchors_path
+from input_executor import POLICY_SKIP, PRIORITY_INTERACTIVE, REJECTED, SKIPPED, freeze_plan
+from automation_service import MAX_SCHEDULE_SLEEP, AutomationService, find_downloads_directory, load_browser_task
+from pipeline import load_pipeline
+from daemon import DaemonClient
+
+startup_timer.mark("imports")
+
+# How often captured input is moved from the listener buffer into the UI, in milliseconds (~30 fps)
+CAPTURE_FRAME_MS = 33
+# How often the run history summary checks for new runs, in milliseconds
+HISTORY_REFRESH_MS = 1000
+# The summary shows this many of the newest runs and up to this many tasks
+HISTORY_RUNS_SHOWN = 10
+HISTORY_TASKS_SHOWN = 3
+# Bubble colour per run status; anything else (errors) is red
+HISTORY_COLORS = {'success': 'green', 'stopped': 'orange'}
 
 class AutomationApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Selenium Automation")
         self.setup_gui()
+        startup_timer.mark("build window")
 
-        self.target_directory = os.path.join(os.path.expanduser("~"), "Downloads", "Finviz")
-        self.chrome_options = webdriver.ChromeOptions()
-        self.chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        self.chrome_options.add_experimental_option('prefs', {
-            "download.default_directory": self.target_directory,
-            "download.prompt_for_download": False,
-            "download.directory_upgrade": True,
-            "safe browsing.enabled": True
-        })
+        # Scheduling, replay and file handling live in the service so they can also run headless
+        self.service = AutomationService()
+        self.service.replayer.on_progress = self.update_progress
+        self.daemon = None
+        # Newest run id drawn in the history summary, so it is only redrawn when runs are added
+        self.history_last_id = None
 
         self.user_actions = []
         self.recording = False
         self.task_name = ""
         self.mouse_listener = None
         self.keyboard_listener = None
-        self.stop_replay_flag = False
-        self.pause_replay_flag = False
-        self.scheduled_tasks = []
-
-        self.stop_event = threading.Event()
-        self.pause_event = threading.Event()
+        self.capture_buffer = CaptureBuffer()
+        self.capture_after_id = None
+        self.move_simplifier = MoveSimplifier()
+        # Image patches around each recorded click, used to re-aim clicks when "Anchor Clicks" is ticked
+        self.patch_recorder = None
+        self.anchors = AnchorSet()
+        # Screen fingerprints for the wait steps inserted before clicks that follow a long pause
+        self.fingerprint_recorder = None
+        self.last_input_time = None
+        self.locator = None
+        self.schedule_after_id = None
+        # Number of recorded actions replayed so far, written by the replay thread
+        self.replay_position = 0
+        # InputJob of the last replay started from the window; stop and pause act on the running job
+        self.replay_job = None
+        startup_timer.mark("automation service")
+
+        # Everything else waits until the window has been drawn once
+        self.root.after_idle(lambda: self.root.after(0, self.finish_startup))
+
+    def finish_startup(self):
+        """ Fill in the calendar and the schedule after the first frame is on screen. """
+        startup_timer.mark("first frame")
+        self.build_calendar()
+        startup_timer.mark("calendar")
+
+        # When the daemon is running it owns the schedule and this window is just a client.
+        # Otherwise the window takes the schedule lock, so a daemon started later refuses to run.
+        daemon = DaemonClient()
+        if daemon.ping() or not self.service.claim_schedule():
+            # A daemon that holds the lock but does not answer yet is still starting up
+            self.daemon = daemon
+        startup_timer.mark("daemon check")
 
         self.load_scheduled_tasks()
 
         # Start checking the schedule
-        self.root.after(1000, self.check_schedule)
+        self.arm_schedule_timer()
+        startup_timer.mark("scheduled tasks")
+        self.refresh_history()
+        print(startup_timer.report(first_frame_phase="first frame"))
+        startup_timer.save(first_frame_phase="first frame")
 
     def move_csv_files(self):
-        try:
-            downloads_dir = self.find_downloads_directory()
-            desktop_dir = Path.home() / "Desktop"
-            finviz_dir = desktop_dir / "Finviz"
-            tradingview_dir = desktop_dir / "TradingView"
-
-            if not finviz_dir.exists():
-                finviz_dir.mkdir(parents=True)
-                print(f"Created directory: {finviz_dir}")
-
-            if not tradingview_dir.exists():
-                tradingview_dir.mkdir(parents=True)
-                print(f"Created directory: {tradingview_dir}")
-
-            for file_name in os.listdir(downloads_dir):
-                if file_name.endswith(".csv") and "finviz" in file_name.lower():
-                    source_path = os.path.join(downloads_dir, file_name)
-                    destination_path = os.path.join(finviz_dir, file_name)
-                    try:
-                        shutil.move(source_path, destination_path)
-                        print(f"Moved {file_name} to {finviz_dir}")
-                    except Exception as e:
-                        print(f"Failed to move {file_name}: {e}")
-
-            current_date = datetime.now().strftime("%Y-%m-%d")
-            stock_screener_pattern = re.compile(rf"stock screener_\d{{4}}-\d{{2}}-\d{{2}}\.csv$", re.IGNORECASE)
-
-            for file_name in os.listdir(downloads_dir):
-                if stock_screener_pattern.match(file_name):
-                    source_path = os.path.join(downloads_dir, file_name)
-                    destination_path = os.path.join(tradingview_dir, file_name)
-                    try:
-                        shutil.move(source_path, destination_path)
-                        print(f"Moved {file_name} to {tradingview_dir}")
-                    except Exception as e:
-                        print(f"Failed to move {file_name}: {e}")
-
-            self.delete_old_files(finviz_dir)
-            self.delete_old_files(tradingview_dir)
+        # While the daemon owns the schedule, its own watcher (serve --move-files) routes downloads
+        if self.service.schedule_lock.held:
+            self.service.move_csv_files()
 
-        except Exception as e:
-            print(f"An error occurred in move_csv_files: {e}")
+    def toggle_move_files(self):
+        """ Start or stop watching Downloads when the "Move CSV Files" checkbox changes. """
+        if self.move_files_var.get():
+            if not self.service.schedule_lock.held:
+                # Two watchers would race to move the same files
+                self.move_files_var.set(False)
+                messagebox.showwarning("Warning", "The automation daemon runs the schedule, so this window does not "
+                                                  "move files. Start the daemon with --move-files instead.")
+                return
+            self.service.download_watcher.start()
+        else:
+            self.service.download_watcher.stop()
 
     def get_desktop_path(self):
         """ Return the path to the user's Desktop directory. """
@@ -108,21 +134,12 @@ class AutomationApp:
         return found_folders
 
     def delete_old_files(self, directory):
-        """ Delete all but the most recent files in the given directory. """
-        try:
-            directory = Path(directory)
-            files = [f for f in directory.iterdir() if f.is_file()]
-            if files:
-                files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-                files_to_delete = files[1:]  # All but the most recent file
-                for file in files_to_delete:
-                    try:
-                        file.unlink()
-                        print(f"Deleted old file: {file}")
-                    except Exception as e:
-                        print(f"Failed to delete {file}: {e}")
-        except Exception as e:
-            print(f"An error occurred in delete_old_files: {e}")
+        """ Delete (or archive) all but the most recent files in the given directory. """
+        self.service.delete_old_files(directory)
+
+    def toggle_archive_mode(self):
+        # Copied to a plain attribute because delete_old_files also runs on the watcher thread
+        self.service.archive_mode = self.archive_files_var.get()
 
     def prompt_delete_old_files(self):
         """ Prompt the user to delete old files in target folders. """
@@ -141,9 +158,7 @@ class AutomationApp:
                 messagebox.showerror("Error", f"An error occurred: {e}")
 
     def find_downloads_directory(self):
-        # Platform-independent method to find the downloads directory
-        downloads_dir = str(Path.home() / "Downloads")
-        return downloads_dir
+        return find_downloads_directory()
 
     def on_task_completion(self):
         # Move CSV files from downloads directory to Finviz directory
@@ -170,15 +185,46 @@ class AutomationApp:
         self.task_name_entry = tk.Entry(task_frame, width=30, font=font)
         self.task_name_entry.grid(row=0, column=1, padx=padx, pady=pady, columnspan=2, sticky='w')
 
+        # Checkbox for recording mouse movement as well as clicks
+        self.record_moves_var = tk.BooleanVar()
+        tk.Checkbutton(task_frame, text="Record Mouse Movement", variable=self.record_moves_var, font=font,
+                       bg='#34495e', fg='white', selectcolor='#2c3e50').grid(row=1, column=0, padx=padx, pady=pady,
+                                                                            sticky='w')
+
+        # Checkbox for capturing click anchors while recording and re-aiming clicks during replay
+        self.anchor_clicks_var = tk.BooleanVar()
+        tk.Checkbutton(task_frame, text="Anchor Clicks", variable=self.anchor_clicks_var, font=font,
+                       bg='#34495e', fg='white', selectcolor='#2c3e50').grid(row=1, column=5, padx=padx, pady=pady,
+                                                                            sticky='w')
+
+        # Checkbox for inserting "wait until the screen is ready" steps before clicks that follow long pauses
+        self.auto_wait_var = tk.BooleanVar()
+        tk.Checkbutton(task_frame, text="Wait Before Clicks", variable=self.auto_wait_var, font=font,
+                       bg='#34495e', fg='white', selectcolor='#2c3e50').grid(row=0, column=5, padx=padx, pady=pady,
+                                                                            sticky='w')
+
         # Checkbox for moving files
         self.move_files_var = tk.BooleanVar()
         self.move_files_checkbox = tk.Checkbutton(task_frame, text="Move CSV Files", variable=self.move_files_var,
-                                                  font=font, bg='#34495e', fg='white', selectcolor='#2c3e50')
+                                                  font=font, bg='#34495e', fg='white', selectcolor='#2c3e50',
+                                                  command=self.toggle_move_files)
         self.move_files_checkbox.grid(row=1, column=1, columnspan=2, padx=padx, pady=pady, sticky='w')
+        # Checkbox for archiving old files instead of deleting them
+        self.archive_files_var = tk.BooleanVar()
+        tk.Checkbutton(task_frame, text="Archive Old Files", variable=self.archive_files_var, font=font, bg='#34495e',
+                       fg='white', selectcolor='#2c3e50', command=self.toggle_archive_mode).grid(row=0, column=3,
+                                                                                                columnspan=2,
+                                                                                                padx=padx, pady=pady,
+                                                                                                sticky='w')
         # Add the "Delete Old Files" Button
         tk.Button(task_frame, text="Delete Old Files", command=self.prompt_delete_old_files, bg="#2c3e50", fg="white",
                   font=font).grid(
             row=1, column=2, padx=padx, pady=pady)
+        # Checkbox for saving recordings in the compact binary format
+        self.compact_format_var = tk.BooleanVar()
+        tk.Checkbutton(task_frame, text="Compact Format", variable=self.compact_format_var, font=font,
+                       bg='#34495e', fg='white', selectcolor='#2c3e50').grid(row=1, column=3, columnspan=2, padx=padx,
+                                                                            pady=pady, sticky='w')
 
         # Recording Controls
         tk.Button(task_frame, text="Start Recording", command=self.start_recording_task, bg="#2c3e50", fg="white",
@@ -194,10 +240,13 @@ class AutomationApp:
 
         # Recorded Actions Display
         tk.Label(task_frame, text="Recorded Actions:", font=font, bg='#34495e', fg='white').grid(row=3, column=0,
-                                                                                                 columnspan=5,
+                                                                                                 columnspan=3,
                                                                                                  padx=padx, pady=pady)
-        self.actions_text = scrolledtext.ScrolledText(task_frame, width=50, height=10, font=font)
-        self.actions_text.grid(row=4, column=0, columnspan=5, padx=padx, pady=pady)
+        self.capture_stats_label = tk.Label(task_frame, text="", font=font, bg='#34495e', fg='white')
+        self.capture_stats_label.grid(row=3, column=3, columnspan=2, padx=padx, pady=pady, sticky='e')
+        # Only the visible rows are formatted, so long recordings load and scroll instantly
+        self.actions_view = ActionListView(task_frame, rows=10, width=50, font=font, bg='#34495e')
+        self.actions_view.grid(row=4, column=0, columnspan=5, padx=padx, pady=pady)
 
         # Replay Controls
         tk.Button(task_frame, text="Replay Actions", command=self.replay_actions, bg="#34495e", fg="white",
@@ -206,6 +255,11 @@ class AutomationApp:
                   font=font).grid(row=5, column=1, padx=padx, pady=pady)
         tk.Button(task_frame, text="Stop Replay", command=self.stop_replay, bg="#2c3e50", fg="white", font=font).grid(
             row=5, column=2, padx=padx, pady=pady)
+        # Toggle between the optimized replay plan and raw one-call-per-event replay
+        self.optimize_replay_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(task_frame, text="Optimize Replay", variable=self.optimize_replay_var, font=font,
+                       bg='#34495e', fg='white', selectcolor='#2c3e50').grid(row=8, column=3, columnspan=2, padx=padx,
+                                                                            pady=pady, sticky='w')
 
         # Replay Speed Control
         tk.Label(task_frame, text="Replay Speed (ms delay):", font=font, bg='#34495e', fg='white').grid(row=6, column=0,
@@ -216,6 +270,21 @@ class AutomationApp:
         self.replay_speed.set(100)
         self.replay_speed.grid(row=6, column=1, padx=padx, pady=pady, columnspan=2, sticky='w')
 
+        # Replay timing mode, speed multiplier and idle gap cap for recorded timing
+        self.replay_mode_var = tk.StringVar(value=MODE_FIXED)
+        tk.OptionMenu(task_frame, self.replay_mode_var, *REPLAY_MODES).grid(row=5, column=3, columnspan=2, padx=padx,
+                                                                            pady=pady, sticky='w')
+        tk.Label(task_frame, text="Speed x:", font=font, bg='#34495e', fg='white').grid(row=6, column=3, padx=padx,
+                                                                                       pady=pady, sticky='e')
+        self.speed_multiplier_entry = tk.Entry(task_frame, width=6, font=font)
+        self.speed_multiplier_entry.insert(0, "1.0")
+        self.speed_multiplier_entry.grid(row=6, column=4, padx=padx, pady=pady, sticky='w')
+        tk.Label(task_frame, text="Max gap (s):", font=font, bg='#34495e', fg='white').grid(row=7, column=3, padx=padx,
+                                                                                           pady=pady, sticky='e')
+        self.max_gap_entry = tk.Entry(task_frame, width=6, font=font)
+        self.max_gap_entry.insert(0, "2.0")
+        self.max_gap_entry.grid(row=7, column=4, padx=padx, pady=pady, sticky='w')
+
         # Progress Bar
         tk.Label(task_frame, text="Task Progress:", font=font, bg='#34495e', fg='white').grid(row=7, column=0,
                                                                                               padx=padx, pady=pady,
@@ -234,8 +303,10 @@ class AutomationApp:
         tk.Label(schedule_frame, text="Schedule Date:", font=font, bg='#34495e', fg='white').grid(row=0, column=0,
                                                                                                   padx=padx, pady=pady,
                                                                                                   sticky='w')
-        self.calendar = Calendar(schedule_frame, selectmode='day', year=2023, month=7, day=1)
-        self.calendar.grid(row=1, column=0, padx=padx, pady=pady, rowspan=5, columnspan=2)
+        # The calendar itself is built after the first frame, see build_calendar
+        self.calendar = None
+        self.calendar_frame = tk.Frame(schedule_frame, bg='#34495e', width=250, height=190)
+        self.calendar_frame.grid(row=1, column=0, padx=padx, pady=pady, rowspan=5, columnspan=2)
 
         tk.Label(schedule_frame, text="Set Time:", font=font, bg='#34495e', fg='white').grid(row=6, column=0, padx=padx,
                                                                                              pady=pady, sticky='w')
@@ -267,17 +338,26 @@ class AutomationApp:
         self.delay_entry.grid(row=10, column=1, padx=padx, pady=pady, sticky='w')
 
         tk.Button(schedule_frame, text="Schedule Task",
-                  command=lambda: self.schedule_task()).grid(row=11, column=0, columnspan=2, padx=padx, pady=pady)
-        # Tally Display Frame
-        tally_frame = tk.Frame(self.root, bg='#34495e')
-        tally_frame.grid(row=1, column=0, padx=padx, pady=pady, sticky='n')
-
-        tk.Label(tally_frame, text="Task Repeat Tally:", font=font, bg='#34495e', fg='white').grid(row=0, column=0,
-                                                                                                   padx=padx, pady=pady)
-
-        # Create a canvas for tally display
-        self.tally_canvas = tk.Canvas(tally_frame, width=300, height=100, bg='#34495e', highlightthickness=0)
-        self.tally_canvas.grid(row=1, column=0, padx=padx, pady=pady)
+                  command=lambda: self.schedule_task()).grid(row=11, column=0, padx=padx, pady=pady)
+        tk.Button(schedule_frame, text="Cancel Scheduled Task",
+                  command=self.cancel_scheduled_task).grid(row=11, column=1, padx=padx, pady=pady)
+        # Run History Frame
+        history_frame = tk.Frame(self.root, bg='#34495e')
+        history_frame.grid(row=1, column=0, padx=padx, pady=pady, sticky='n')
+
+        tk.Label(history_frame, text="Run History:", font=font, bg='#34495e', fg='white').grid(row=0, column=0,
+                                                                                             padx=padx, pady=pady)
+
+        # Redrawn from run_history.db, so it stays the same size however many runs there are
+        self.history_canvas = tk.Canvas(history_frame, width=300, height=140, bg='#34495e', highlightthickness=0)
+        self.history_canvas.grid(row=1, column=0, padx=padx, pady=pady)
+
+    def build_calendar(self):
+        if self.calendar is not None:
+            return
+        from tkcalendar import Calendar
+        self.calendar = Calendar(self.calendar_frame, selectmode='day', year=2023, month=7, day=1)
+        self.calendar.pack()
 
     def start_recording_task(self):
         self.task_name = self.task_name_entry.get()
@@ -286,23 +366,84 @@ class AutomationApp:
             return
 
         self.recording = True
-        self.user_actions = []
-        self.actions_text.delete(1.0, tk.END)
-        self.actions_text.insert(tk.END, "Recording started...\n")
-
-        self.mouse_listener = mouse.Listener(on_click=self.on_click)
+        self.close_recording()
+        self.capture_buffer.reset()
+        self.move_simplifier.reset()
+        self.actions_view.set_actions(self.user_actions, follow_tail=True)
+        self.actions_view.show_message("Recording started...")
+
+        # pynput hooks the OS input stack on import, so only load it once recording is used
+        from pynput import mouse, keyboard
+        on_move = self.on_move if self.record_moves_var.get() else None
+        self.anchors = AnchorSet()
+        self.locator = None
+        if self.anchor_clicks_var.get():
+            self.patch_recorder = PatchRecorder()
+        if self.auto_wait_var.get():
+            self.fingerprint_recorder = FingerprintRecorder()
+        self.last_input_time = time.time()
+        self.mouse_listener = mouse.Listener(on_click=self.on_click, on_move=on_move)
         self.mouse_listener.start()
 
         self.keyboard_listener = keyboard.Listener(on_press=self.on_press)
         self.keyboard_listener.start()
 
+        if self.capture_after_id is None:
+            self.capture_after_id = self.root.after(CAPTURE_FRAME_MS, self.drain_capture_buffer)
+
     def stop_recording_task(self):
         self.recording = False
         if self.mouse_listener:
             self.mouse_listener.stop()
         if self.keyboard_listener:
             self.keyboard_listener.stop()
-        self.actions_text.insert(tk.END, "Recording stopped.\n")
+        if self.patch_recorder is not None:
+            self.set_anchors(self.patch_recorder.stop())
+            self.patch_recorder = None
+            self.actions_view.show_message(f"Captured {len(self.anchors)} click anchors.")
+        if self.capture_after_id is not None:
+            self.root.after_cancel(self.capture_after_id)
+            self.capture_after_id = None
+        self.drain_capture_buffer()
+        self.add_recorded_actions([{"action": "mouseMove", "x": x, "y": y, "time": t}
+                                   for x, y, t in self.move_simplifier.flush()])
+        if self.fingerprint_recorder is not None:
+            fingerprints = self.fingerprint_recorder.stop()
+            self.fingerprint_recorder = None
+            waits = [action for action in self.user_actions if action["action"] == "waitStable"]
+            for action in waits:
+                if action["time"] in fingerprints:
+                    action["fingerprint"] = fingerprints[action["time"]]
+            self.actions_view.show_message(f"Inserted {len(waits)} wait steps before clicks.")
+        message = "Recording stopped."
+        if self.move_simplifier.raw_points:
+            message += (f" Mouse path: {self.move_simplifier.raw_points} points captured, "
+                        f"{self.move_simplifier.kept_points} kept "
+                        f"({self.move_simplifier.compression_ratio:.1f}x compression)")
+        self.actions_view.show_message(message)
+
+    def drain_capture_buffer(self):
+        """ Move captured events into user_actions and the display in one batch per frame. """
+        actions = []
+        queue_depth = len(self.capture_buffer)
+        for event in self.capture_buffer.drain():
+            if event[0] == "mouseMove":
+                points = self.move_simplifier.add(event[1], event[2], event[4])
+            else:
+                # Settle the path first so the moves land before the click or key press
+                points = self.move_simplifier.flush()
+            actions.extend({"action": "mouseMove", "x": x, "y": y, "time": t} for x, y, t in points)
+            if event[0] != "mouseMove":
+                actions.append(event_to_action(event))
+        self.add_recorded_actions(actions)
+        metrics.registry.gauge("capture_queue_depth").set(queue_depth)
+        metrics.registry.gauge("capture_dropped_events").set(self.capture_buffer.dropped)
+        self.capture_stats_label.config(
+            text=f"Queued: {self.capture_buffer.queued}  Dropped: {self.capture_buffer.dropped}")
+        if self.recording:
+            self.capture_after_id = self.root.after(CAPTURE_FRAME_MS, self.drain_capture_buffer)
+        else:
+            self.capture_after_id = None
 
     def save_recording(self):
         if not self.user_actions:
@@ -314,9 +455,23 @@ class AutomationApp:
         directory = "recordings"
         if not os.path.exists(directory):
             os.makedirs(directory)
-        file_path = os.path.join(directory, f"{self.task_name}.json")
-        with open(file_path, 'w') as f:
-            json.dump(self.user_actions, f, indent=4)
+        if self.compact_format_var.get():
+            file_path = os.path.join(directory, f"{self.task_name}{BINARY_EXTENSION}")
+            try:
+                write_recording(self.user_actions, file_path)
+            except ValueError as e:
+                messagebox.showerror("Error", f"Could not save in compact format: {e}")
+                return
+        else:
+            file_path = os.path.join(directory, f"{self.task_name}.json")
+            with open(file_path, 'w') as f:
+                json.dump(list(self.user_actions), f, indent=4)
+        if self.anchors:
+            try:
+                self.anchors.save(anchors_path(self.task_name))
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not save click anchors: {e}")
+        self.service.catalog.update(self.task_name)
         messagebox.showinfo("Info", f"Task saved as {file_path}")
 
     def load_recording(self):
@@ -324,46 +479,78 @@ class AutomationApp:
         if not self.task_name:
             messagebox.showwarning("Warning", "Please enter a task name.")
             return
+        binary_path = os.path.join("recordings", f"{self.task_name}{BINARY_EXTENSION}")
         file_path = os.path.join("recordings", f"{self.task_name}.json")
-        if not os.path.exists(file_path):
+        if os.path.exists(binary_path):
+            # Compact recordings are memory-mapped and decoded lazily during replay
+            self.close_recording()
+            file_path = binary_path
+            self.user_actions = RecordingReader(binary_path)
+        elif os.path.exists(file_path):
+            self.close_recording()
+            # Shared with the catalog cache; recording always starts a new list
+            self.user_actions = self.service.catalog.load(self.task_name)
+        else:
             messagebox.showerror("Error", f"No recording found for task name: {self.task_name}")
             return
-        with open(file_path, 'r') as f:
-            self.user_actions = json.load(f)
+        anchor_file = anchors_path(self.task_name)
+        self.set_anchors(AnchorSet.load(anchor_file) if os.path.exists(anchor_file) else AnchorSet())
         self.update_actions_display()
         messagebox.showinfo("Info", f"Loaded task from {file_path}")
 
+    def set_anchors(self, anchors):
+        self.anchors = anchors
+        self.locator = VisualLocator(anchors) if anchors else None
+
+    def close_recording(self):
+        """ Release the memory map behind a loaded compact recording. """
+        if isinstance(self.user_actions, RecordingReader):
+            self.user_actions.close()
+        self.user_actions = []
+
     def delete_task(self):
         self.task_name = self.task_name_entry.get().strip()
         if not self.task_name:
             messagebox.showwarning("Warning", "Please enter a task name.")
             return
-        file_path = os.path.join("recordings", f"{self.task_name}.json")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        file_paths = [os.path.join("recordings", f"{self.task_name}{extension}")
+                      for extension in (".json", BINARY_EXTENSION, ANCHOR_EXTENSION)]
+        file_paths = [file_path for file_path in file_paths if os.path.exists(file_path)]
+        if file_paths:
+            if isinstance(self.user_actions, RecordingReader) and self.user_actions.path in file_paths:
+                self.close_recording()
+            for file_path in file_paths:
+                os.remove(file_path)
+            self.service.catalog.remove(self.task_name)
             messagebox.showinfo("Info", f"Deleted task {self.task_name}")
         else:
             messagebox.showerror("Error", f"No recording found for task name: {self.task_name}")
 
     def update_actions_display(self):
-        self.actions_text.delete('1.0', tk.END)
-        for action in self.user_actions:
-            if 'type' in action:
-                if action["type"] == "mouse_click":
-                    self.actions_text.insert(tk.END,
-                                             f"Mouse click at ({action['x']}, {action['y']}) - {action['button']} {'pressed' if action.get('pressed', False) else 'released'}\n")
-                elif action["type"] == "key_press":
-                    self.actions_text.insert(tk.END, f"Key pressed: {action['key']}\n")
-            else:
-                self.actions_text.insert(tk.END, f"Unknown action format: {action}\n")
+        self.actions_view.set_actions(self.user_actions)
+
+    def add_recorded_actions(self, actions):
+        if actions:
+            self.user_actions.extend(actions)
+            self.actions_view.actions_added()
+
+    def on_move(self, x, y):
+        if self.recording:
+            self.capture_buffer.push(("mouseMove", x, y, None, time.time()))
 
     def on_click(self, x, y, button, pressed):
+        # Runs on the pynput listener thread: only hand the event to the capture buffer
         if self.recording:
-            button_name = button.name  # Convert mouse.Button object to string
             action_type = "mouseDown" if pressed else "mouseUp"
-            action = {"action": action_type, "x": x, "y": y, "button": button_name, "time": time.time()}
-            self.user_actions.append(action)
-            self.actions_text.insert(tk.END, f"{action}\n")
+            timestamp = time.time()
+            if pressed and self.fingerprint_recorder is not None and timestamp - self.last_input_time >= AUTO_WAIT_PAUSE:
+                # The user waited for something before clicking: replay waits for the screen instead of the clock
+                self.capture_buffer.push(("waitStable", x, y, None, timestamp))
+                self.fingerprint_recorder.request(x, y, timestamp)
+            self.last_input_time = timestamp
+            self.capture_buffer.push((action_type, x, y, button.name, timestamp))
+            if pressed and self.patch_recorder is not None:
+                self.patch_recorder.request(x, y, timestamp)
 
     def on_press(self, key):
         if self.recording:
@@ -371,68 +558,114 @@ class AutomationApp:
                 key_name = key.char
             except AttributeError:
                 key_name = str(key)
-            action = {"action": "keyPress", "key": key_name, "time": time.time()}
-            self.user_actions.append(action)
-            self.actions_text.insert(tk.END, f"{action}\n")
+            self.last_input_time = time.time()
+            self.capture_buffer.push(("keyPress", None, None, key_name, self.last_input_time))
 
     def replay_actions(self):
         if not self.user_actions:
             messagebox.showwarning("Warning", "No recorded actions to replay.")
             return
-        self.stop_replay_flag = False
-        self.pause_replay_flag = False
-        self.progress["value"] = 0
-        self.progress["maximum"] = len(self.user_actions)
-        threading.Thread(target=self._replay_actions).start()
+        settings = self.get_replay_settings()
+        locator = self.locator if settings["anchor"] else None
+        # The job keeps its own copy of the action sequence, so recording again cannot change it, and
+        # its own reader of a compact recording, so loading or deleting another one cannot close it
+        if isinstance(self.user_actions, RecordingReader):
+            plan = RecordingReader(self.user_actions.path)
+        else:
+            plan = freeze_plan(self.user_actions)
 
-        # Move CSV files after replaying actions
-        if self.move_files_var.get():
-            self.move_csv_files()
-
-    def _replay_actions(self):
-        for index, action in enumerate(self.user_actions):
-            if self.stop_replay_flag:
-                break
-            while self.pause_replay_flag:
-                time.sleep(0.1)
-            action_type = action["action"]
-            delay = self.replay_speed.get() / 1000
-            if action_type == "mouseDown" or action_type == "mouseUp":
-                x, y = action["x"], action["y"]
-                button = action["button"]
-                self.perform_mouse_click(action_type, x, y, button)
-            elif action_type == "keyPress":
-                key = action["key"]
-                pyautogui.press(key)
-            time.sleep(delay)
-            self.progress["value"] = index + 1
-
-    def perform_mouse_click(self, action_type, x, y, button):
-        button_str = button  # Button is already in string format
-        pyautogui.moveTo(x, y)
-        if action_type == "mouseDown":
-            pyautogui.mouseDown(button=button_str)
-        elif action_type == "mouseUp":
-            pyautogui.mouseUp(button=button_str)
+        # Window replays are stored in the run history like scheduled ones
+        task = {'task_name': self.task_name or "window replay", 'type': 'replay'}
+
+        def replay(job):
+            started = time.time()
+            try:
+                completed = self.service.replayer.replay(plan, settings, locator, job)
+            except Exception as e:
+                self.service.record_run(task, 0, 'error', started, str(e))
+                raise
+            finally:
+                if isinstance(plan, RecordingReader):
+                    plan.close()
+            self.service.record_run(task, 0, 'success' if completed else 'stopped', started)
+
+        executor = self.service.executor
+        job = executor.submit("window replay", replay, PRIORITY_INTERACTIVE, policy=POLICY_SKIP)
+        if job.done and isinstance(plan, RecordingReader):
+            plan.close()
+        if job.state == SKIPPED:
+            messagebox.showwarning("Warning", "A replay from this window is already running or queued.")
+            return
+        if job.state == REJECTED:
+            messagebox.showwarning("Warning", "Too many jobs are waiting for the mouse and keyboard.")
+            return
+        if executor.current is not None and executor.current is not job:
+            self.actions_view.show_message(f"Replay queued behind {executor.current.name}.")
+        self.replay_job = job
+        self.progress["value"] = 0
+        self.progress["maximum"] = len(plan)
+        self.replay_position = 0
+        self.follow_replay()
+
+    def follow_replay(self):
+        """ Update the progress bar and highlight the action being replayed, once per frame and on the Tk thread. """
+        self.progress["value"] = self.replay_position
+        if self.replay_position:
+            self.actions_view.set_current(self.replay_position - 1)
+        if self.replay_job is not None and not self.replay_job.done:
+            self.root.after(CAPTURE_FRAME_MS, self.follow_replay)
+
+    def get_replay_settings(self):
+        """ Read the replay controls once so the worker thread never touches Tk widgets. """
+        try:
+            speed = float(self.speed_multiplier_entry.get())
+        except ValueError:
+            speed = 1.0
+        try:
+            max_gap = float(self.max_gap_entry.get())
+        except ValueError:
+            max_gap = 2.0
+        return {
+            "mode": self.replay_mode_var.get(),
+            "delay": self.replay_speed.get() / 1000,
+            "speed": speed,
+            "max_gap": max_gap,
+            "optimize": self.optimize_replay_var.get(),
+            "anchor": self.anchor_clicks_var.get()
+        }
+
+    def update_progress(self, value):
+        # Called on the executor thread; follow_replay shows it from the Tk thread
+        self.replay_position = value
 
     def pause_replay(self):
-        self.pause_replay_flag = not self.pause_replay_flag
-        if self.pause_replay_flag:
-            self.actions_text.insert(tk.END, "Replay paused.\n")
+        job = self.service.executor.current
+        if job is None:
+            self.actions_view.show_message("Nothing is replaying.")
+            return
+        if job.toggle_pause():
+            self.actions_view.show_message(f"Replay paused: {job.name}.")
         else:
-            self.actions_text.insert(tk.END, "Replay resumed.\n")
+            self.actions_view.show_message("Replay resumed.")
 
     def stop_replay(self):
-        self.stop_replay_flag = True
-        self.actions_text.insert(tk.END, "Replay stopped.\n")
-
-        # Move CSV files if checkbox is checked
-        if self.move_files_var.get():
-            self.move_csv_files()
+        """ Stop the running replay, scheduled or not, and drop a window replay still waiting behind it
+        or waiting out the delay before its next repeat. Other tasks' later repeats are left alone. """
+        executor = self.service.executor
+        job = executor.current
+        if job is not None:
+            job.stop()
+        if self.replay_job is not None:
+            if self.replay_job.done:
+                executor.cancel_delayed(self.replay_job.key)
+            else:
+                executor.cancel(self.replay_job.key)
+        self.actions_view.show_message("Replay stopped.")
 
     def schedule_task(self):
         try:
             # Retrieve the selected date and time from the UI
+            self.build_calendar()
             selected_date = self.calendar.get_date()
             hour = self.hour_slider.get()
             minute = self.minute_slider.get()
@@ -456,110 +689,159 @@ class AutomationApp:
 
             # Retrieve the task name and actions
             task_name = self.task_name_entry.get()
-            actions = self.user_actions  # Assuming you want to use the currently recorded actions
-
-            # Add the scheduled task
-            self.scheduled_tasks.append({
+            # Loaded and finished recordings are never modified, so every run scheduled from one shares it
+            if isinstance(self.user_actions, list) and not self.recording:
+                actions = self.user_actions
+            else:
+                actions = list(self.user_actions)
+            task = {
                 'task_name': task_name,
                 'actions': actions,
                 'time': scheduled_time,
                 'repeat': repeat_times,
                 'delay': delay_between_repeats
-            })
+            }
 
-            # Update the scheduled tasks display
-            self.update_scheduled_tasks_text()
+            if self.daemon is not None:
+                self.daemon.add_task(task_name, scheduled_time, repeat_times, delay_between_repeats, actions)
+                self.update_scheduled_tasks_text()
+                return
+
+            # Tasks with a browser definition download through Selenium instead of replaying input
+            browser_task = load_browser_task(task_name)
+            if browser_task is not None:
+                task.update({'type': 'browser', 'browser': browser_task, 'actions': []})
+            # Tasks with a pipeline definition run its stages, e.g. replay, wait for the download, then ingest
+            pipeline = load_pipeline(task_name)
+            if browser_task is None and pipeline is not None:
+                task.update({'type': 'pipeline', 'pipeline': pipeline, 'actions': []})
+
+            # Add the scheduled task
+            self.service.add_task(task)
+            self.on_schedule_changed()
 
         except Exception as e:
             print(f"Failed to schedule task: {e}")
 
-    def save_scheduled_tasks(self):
-        tasks_to_save = []
-        for task in self.scheduled_tasks:
-            task_copy = task.copy()
-            task_copy['time'] = task_copy['time'].isoformat()
-            tasks_to_save.append(task_copy)
-        with open("scheduled_tasks.json", 'w') as file:
-            json.dump(tasks_to_save, file, indent=4)
+    def cancel_scheduled_task(self):
+        """ Cancel every scheduled run of the task named in the task name entry. """
+        task_name = self.task_name_entry.get().strip()
+        if self.daemon is not None:
+            try:
+                cancelled = self.daemon.cancel(task_name=task_name)
+            except (OSError, RuntimeError) as e:
+                # The daemon stopped, or refused the request
+                messagebox.showerror("Error", f"Could not cancel {task_name} through the automation daemon: {e}")
+                return
+        else:
+            cancelled = self.service.cancel_by_name(task_name)
+        if not cancelled:
+            messagebox.showwarning("Warning", f"No scheduled runs found for task name: {task_name}")
+            return
+        self.on_schedule_changed()
 
     def load_scheduled_tasks(self):
-        try:
-            with open("scheduled_tasks.json", 'r') as file:
-                content = file.read()
-                if not content:
-                    self.scheduled_tasks = []
-                    return
-
-                tasks_from_file = json.loads(content)
-                self.scheduled_tasks = []
-                for task in tasks_from_file:
-                    task_copy = task.copy()
-                    task_copy['time'] = datetime.fromisoformat(task_copy['time'])
-                    self.scheduled_tasks.append(task_copy)
-                self.update_scheduled_tasks_text()
-        except FileNotFoundError:
-            self.scheduled_tasks = []
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
-            self.scheduled_tasks = []
+        if self.daemon is None:
+            self.service.load()
+        self.update_scheduled_tasks_text()
 
     def update_scheduled_tasks_text(self):
         self.scheduled_tasks_text.delete(1.0, tk.END)
-        for task in self.scheduled_tasks:
+        if self.daemon is not None:
+            self.scheduled_tasks_text.insert(tk.END, "Scheduled by the automation daemon\n")
+            try:
+                tasks = self.daemon.list_tasks()
+            except (OSError, RuntimeError) as e:
+                # e.g. another window holds the schedule lock, or the daemon is still starting
+                owner = self.service.schedule_lock.owner()
+                self.scheduled_tasks_text.insert(tk.END, f"The schedule is run by another process"
+                                                         f"{f' (pid {owner})' if owner else ''}: {e}\n")
+                return
+        else:
+            lateness = self.service.scheduler.lateness
+            if lateness.count:
+                self.scheduled_tasks_text.insert(tk.END,
+                                                 f"Fire lateness: last {lateness.last:.3f}s, avg {lateness.mean:.3f}s, max {lateness.max:.3f}s\n")
+            tasks = self.service.list_tasks()
+        for task in tasks:
             # Format the datetime object directly
             task_time = task["time"].strftime("%Y-%m-%d %H:%M:%S")
             self.scheduled_tasks_text.insert(tk.END,
                                              f"Task: {task['task_name']}, Scheduled Time: {task_time}, Repeat: {task['repeat']} times, Delay: {task['delay']} seconds\n")
 
-    def check_schedule(self):
-        now = datetime.now()  # Get current time as a datetime object
-        for task in self.scheduled_tasks:
-            if now >= task["time"]:  # Compare datetime objects
-                threading.Thread(target=self.execute_scheduled_task, args=(task,)).start()
-                self.scheduled_tasks.remove(task)
-        self.save_scheduled_tasks()
+    def on_schedule_changed(self):
+        """ Redraw the schedule and re-arm the timer for the new earliest task. """
         self.update_scheduled_tasks_text()
-        self.root.after(1000, self.check_schedule)
-
-        # Move CSV files if checkbox is checked
-        if self.move_files_var.get():
-            self.move_csv_files()
-
-    def execute_scheduled_task(self, task):
-        print(f"Executing task: {task['task_name']}")  # Debug print
-        if 'actions' in task:
-            self.user_actions = task["actions"]
-        else:
-            print(f"Task does not contain 'actions': {task}")
+        self.arm_schedule_timer()
+
+    def arm_schedule_timer(self):
+        """ Sleep until the next task is due instead of polling every second. """
+        if self.schedule_after_id is not None:
+            self.root.after_cancel(self.schedule_after_id)
+            self.schedule_after_id = None
+        if self.daemon is not None:
             return
-        repeat_times = task["repeat"]
-        delay_between_repeats = task["delay"]
-        for i in range(repeat_times):
-            try:
-                self.replay_actions()
-                self.update_tally(i, 'success')  # Mark this repeat as successful
-            except Exception as e:
-                print(f"Error executing task: {e}")
-                self.update_tally(i, 'error')  # Mark this repeat as failed
-            time.sleep(delay_between_repeats)
+        delay = self.service.scheduler.seconds_until_next()
+        if delay is None:
+            return
+        # Cap the sleep so wall clock changes (suspend, DST) are noticed within a minute
+        delay_ms = int(min(delay, MAX_SCHEDULE_SLEEP) * 1000)
+        self.schedule_after_id = self.root.after(delay_ms, self.check_schedule)
 
-    def update_tally(self, repeat_index, status):
-        # Define colors
-        color = 'green' if status == 'success' else 'red'
+    def check_schedule(self):
+        self.schedule_after_id = None
+        # Read the replay controls here, on the Tk thread, for any task that fires now
+        self.service.replay_settings = self.get_replay_settings()
+        if self.service.run_due_tasks():
+            self.on_schedule_changed()
+        else:
+            self.arm_schedule_timer()
 
-        # Calculate position
-        x = 10 + repeat_index * 30
-        y = 50
+    def refresh_history(self):
+        """ Redraw the run history summary when runs were added, here or by the daemon. """
+        try:
+            last_id = self.service.history.last_id()
+            if last_id != self.history_last_id:
+                self.history_last_id = last_id
+                self.draw_history()
+        except sqlite3.Error as e:
+            print(f"Failed to read run history: {e}")
+        self.root.after(HISTORY_REFRESH_MS, self.refresh_history)
+
+    def draw_history(self):
+        history = self.service.history
+        runs = history.last_runs(HISTORY_RUNS_SHOWN)
+        canvas = self.history_canvas
+        canvas.delete('all')
+        if not runs:
+            canvas.create_text(10, 20, text="No runs yet", anchor='w', fill='white')
+            return
 
-        # Draw or update the bubble
-        radius = 20
-        self.tally_canvas.create_oval(x - radius, y - radius, x + radius, y + radius, fill=color, outline='black')
+        # Newest run on the right
+        radius = 10
+        for i, run in enumerate(reversed(runs)):
+            x = 15 + i * 28
+            color = HISTORY_COLORS.get(run['status'], 'red')
+            canvas.create_oval(x - radius, 20 - radius, x + radius, 20 + radius, fill=color, outline='black')
+
+        # Success rate and durations over the recent runs of the tasks that ran last
+        tasks = []
+        for run in runs:
+            if run['task_name'] not in tasks:
+                tasks.append(run['task_name'])
+        for i, task_name in enumerate(tasks[:HISTORY_TASKS_SHOWN]):
+            stats = history.recent_stats(task_name)
+            text = (f"{task_name[:14]}: {stats['success_rate']:.0%} ok, p50 {stats['p50']:.1f}s, "
+                    f"p95 {stats['p95']:.1f}s ({stats['runs']})")
+            canvas.create_text(5, 50 + i * 30, text=text, anchor='w', fill='white')
 
     def run(self):
         self.root.mainloop()
+        self.service.close()
 
 
 if __name__ == "__main__":
     root = tk.Tk()
+    startup_timer.mark("create Tk root")
     app = AutomationApp(root)
     app.run()
@@ -0,0 +1,191 @@
+import array
+import bisect
+import tkinter as tk
+
+ALL_TYPES = "All actions"
+ACTION_TYPES = ("mouseDown", "mouseUp", "mouseMove", "keyPress", "waitStable")
+
+
+def format_action(action):
+    """ One short display line for a recorded action. """
+    action_type = action.get("action")
+    if action_type in ("mouseDown", "mouseUp"):
+        return f"{action_type:<10} ({action['x']}, {action['y']}) {action.get('button', '')}"
+    if action_type == "mouseMove":
+        return f"{action_type:<10} ({action['x']}, {action['y']})"
+    if action_type == "keyPress":
+        return f"{action_type:<10} {action['key']}"
+    if action_type == "waitStable":
+        return f"{action_type:<10} near ({action['x']}, {action['y']})"
+    # Recordings from older versions of the app
+    if action.get("type") == "mouse_click":
+        state = 'pressed' if action.get('pressed', False) else 'released'
+        return f"Mouse click at ({action['x']}, {action['y']}) - {action['button']} {state}"
+    if action.get("type") == "key_press":
+        return f"Key pressed: {action['key']}"
+    return f"Unknown action format: {action}"
+
+
+class ActionListView(tk.Frame):
+    """ Scrollable list of recorded actions that only ever formats the rows on screen.
+
+    `actions` can be any sequence with len() and indexing, such as a list or a memory-mapped
+    RecordingReader. The text widget holds exactly `rows` lines, so rendering cost does not
+    grow with the recording; the scrollbar is driven by hand from the row offset.
+    """
+
+    def __init__(self, master, rows=10, width=50, font=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.rows = rows
+        self.actions = []
+        self.top = 0
+        self.current = None
+        self.follow_tail = True
+        # Positions of the matching actions while a type filter is on, None when showing everything
+        self._matches = None
+        self._filter_scanned = 0
+
+        controls = tk.Frame(self, bg=kwargs.get("bg"))
+        controls.grid(row=0, column=0, columnspan=2, sticky='we')
+        self.filter_var = tk.StringVar(value=ALL_TYPES)
+        tk.OptionMenu(controls, self.filter_var, ALL_TYPES, *ACTION_TYPES,
+                      command=lambda _: self.apply_filter()).pack(side='left')
+        self.jump_entry = tk.Entry(controls, width=8, font=font)
+        self.jump_entry.pack(side='left', padx=(10, 2))
+        self.jump_entry.bind('<Return>', lambda _: self.jump_from_entry())
+        tk.Button(controls, text="Go to #", command=self.jump_from_entry, bg="#2c3e50", fg="white",
+                  font=font).pack(side='left')
+        self.count_label = tk.Label(controls, text="", font=font, bg=kwargs.get("bg"), fg='white')
+        self.count_label.pack(side='right')
+
+        self.text = tk.Text(self, width=width, height=rows, font=font, wrap='none')
+        self.text.grid(row=1, column=0, sticky='nsew')
+        self.text.tag_configure('current', background='#f9e79f')
+        self.scrollbar = tk.Scrollbar(self, orient='vertical', command=self._on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, sticky='ns')
+        for widget in (self.text, self.scrollbar):
+            widget.bind('<MouseWheel>', self._on_wheel)
+            widget.bind('<Button-4>', lambda _: self.scroll_by(-3))
+            widget.bind('<Button-5>', lambda _: self.scroll_by(3))
+        self.text.bind('<Prior>', lambda _: self.scroll_by(-self.rows))
+        self.text.bind('<Next>', lambda _: self.scroll_by(self.rows))
+
+        self.status_label = tk.Label(self, text="", font=font, bg=kwargs.get("bg"), fg='white', anchor='w')
+        self.status_label.grid(row=2, column=0, columnspan=2, sticky='we')
+        self.render()
+
+    # Data
+
+    def set_actions(self, actions, follow_tail=False):
+        """ Show a new action sequence. With follow_tail the view stays on the newest rows as actions are added. """
+        self.actions = actions
+        self.current = None
+        self.follow_tail = follow_tail
+        self.apply_filter(render=False)
+        self.render()
+
+    def actions_added(self):
+        """ Call after appending to the action list; keeps the view on the newest rows while recording. """
+        self._scan_filter()
+        if self.follow_tail:
+            self.top = max(self.row_count - self.rows, 0)
+        self.render()
+
+    @property
+    def row_count(self):
+        return len(self.actions) if self._matches is None else len(self._matches)
+
+    def _index_at(self, row):
+        return row if self._matches is None else self._matches[row]
+
+    def apply_filter(self, render=True):
+        if self.filter_var.get() == ALL_TYPES:
+            self._matches = None
+        else:
+            self._matches = array.array('I')
+            self._filter_scanned = 0
+            self._scan_filter()
+        self.top = 0
+        if render:
+            self.render()
+
+    def _scan_filter(self):
+        # Only the actions added since the last scan are checked
+        if self._matches is None:
+            return
+        wanted = self.filter_var.get()
+        for index in range(self._filter_scanned, len(self.actions)):
+            if self.actions[index].get("action") == wanted:
+                self._matches.append(index)
+        self._filter_scanned = len(self.actions)
+
+    # Navigation
+
+    def scroll_to(self, row):
+        self.top = min(max(int(row), 0), max(self.row_count - self.rows, 0))
+        self.follow_tail = self.top >= self.row_count - self.rows
+        self.render()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+
+    def _on_wheel(self, event):
+        return self.scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, command, value, unit=None):
+        if command == 'moveto':
+            self.scroll_to(float(value) * self.row_count)
+        elif command == 'scroll':
+            self.scroll_by(int(value) * (self.rows if unit == 'pages' else 1))
+
+    def jump_to(self, index):
+        """ Scroll so action number `index` (or the first match after it) is the top row. """
+        row = index if self._matches is None else bisect.bisect_left(self._matches, index)
+        self.scroll_to(row)
+
+    def jump_from_entry(self):
+        try:
+            index = int(self.jump_entry.get())
+        except ValueError:
+            self.show_message("Enter an action number to jump to.")
+            return
+        self.jump_to(index)
+
+    def set_current(self, index):
+        """ Highlight action `index`, scrolling it into view if needed. """
+        if index == self.current:
+            return
+        self.current = index
+        row = index if self._matches is None else bisect.bisect_left(self._matches, index)
+        if not self.top <= row < self.top + self.rows:
+            self.top = min(max(row - self.rows // 2, 0), max(self.row_count - self.rows, 0))
+        self.render()
+
+    def show_message(self, message):
+        self.status_label.config(text=message)
+
+    # Rendering
+
+    def render(self):
+        count = self.row_count
+        last = min(self.top + self.rows, count)
+        lines = []
+        current_line = None
+        for line, row in enumerate(range(self.top, last)):
+            index = self._index_at(row)
+            if index == self.current:
+                current_line = line + 1
+            lines.append(f"{index:>7}  {format_action(self.actions[index])}")
+        self.text.config(state='normal')
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', "\n".join(lines))
+        if current_line is not None:
+            self.text.tag_add('current', f"{current_line}.0", f"{current_line}.end+1c")
+        self.text.config(state='disabled')
+        if count:
+            self.scrollbar.set(self.top / count, last / count)
+        else:
+            self.scrollbar.set(0, 1)
+        shown = f"{count} of {len(self.actions)}" if self._matches is not None else f"{count}"
+        self.count_label.config(text=f"{shown} actions")
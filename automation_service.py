@@ -0,0 +1,427 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from scheduler import TaskScheduler
+from task_store import ScheduleLock, TaskStore
+from recording_format import BINARY_EXTENSION, RecordingReader
+from replayer import ReplayControl, Replayer
+from input_executor import POLICY_QUEUE, PRIORITY_SCHEDULED, InputExecutor, freeze_plan, load_executor_settings
+from browser_pool import DriverPool, run_browser_task, run_directory
+from download_watcher import DownloadWatcher, load_rules
+from csv_archive import CsvArchive, load_retention
+from screener_store import ScreenerStore
+from run_history import RunHistory
+from recording_catalog import RecordingCatalog
+from pipeline import PipelineRunner
+from visual_anchor import AnchorSet, VisualLocator, anchors_path
+
+# Longest single sleep of the scheduler, in seconds, so wall clock changes are noticed
+MAX_SCHEDULE_SLEEP = 60
+
+
+def find_downloads_directory():
+    # Platform-independent method to find the downloads directory
+    downloads_dir = str(Path.home() / "Downloads")
+    return downloads_dir
+
+
+def load_recording_actions(task_name, directory="recordings"):
+    """ Return the saved actions for a task name as a list, preferring the compact format. """
+    binary_path = os.path.join(directory, f"{task_name}{BINARY_EXTENSION}")
+    if os.path.exists(binary_path):
+        reader = RecordingReader(binary_path)
+        try:
+            return list(reader)
+        finally:
+            reader.close()
+    file_path = os.path.join(directory, f"{task_name}.json")
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    return None
+
+
+def load_browser_task(task_name, directory="browser_tasks"):
+    """ Return the browser task definition in browser_tasks/<task_name>.json, or None. """
+    file_path = os.path.join(directory, f"{task_name}.json")
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+class AutomationService:
+    """ Scheduling, replay and file handling without any Tk dependency.
+
+    The Tk window drives it from root.after and the headless daemon from run_forever().
+    `on_schedule_changed()` is called after tasks are added, cancelled or fired, and
+    `on_result(task, repeat_index, status)` after every repeat of a task. Either may be
+    called from a worker thread. Every repeat is also stored in `history` (run_history.db).
+    """
+
+    def __init__(self, tasks_path="scheduled_tasks.json", replay_settings=None):
+        self.scheduler = TaskScheduler()
+        self.task_store = TaskStore(tasks_path)
+        self.schedule_lock = ScheduleLock(os.path.splitext(tasks_path)[0] + ".lock")
+        self.replayer = Replayer()
+        self.replay_settings = replay_settings or {}
+        # Every replay goes through this one worker, so overlapping tasks never share the mouse and keyboard
+        self.executor = InputExecutor(load_executor_settings())
+        # Click anchors per task name, reloaded when the file on disk changes
+        self._locators = {}
+        # Saved recordings by name, parsed once and kept while unchanged on disk
+        self.catalog = RecordingCatalog()
+        # The task store is journaled from the Tk thread, the scheduler thread and control connections
+        self._store_lock = threading.Lock()
+        self.on_schedule_changed = None
+        self.on_result = None
+        # Controls of the pipelines and browser tasks running now, so they can be stopped by task name
+        self._running_controls = {}
+        self.history = RunHistory()
+        try:
+            self.history.prune()
+        except sqlite3.Error as e:
+            print(f"Failed to prune run history: {e}")
+
+        # Headless Chrome sessions for browser tasks, started on first use and reused afterwards
+        self.driver_pool = DriverPool(size=2)
+        # Routes finished downloads to the Finviz/TradingView folders while it is running
+        self.download_watcher = DownloadWatcher(find_downloads_directory(), load_rules(),
+                                                on_file=self.on_file_routed)
+        # Old CSVs are archived instead of deleted while archive_mode is on
+        self.archive_mode = False
+        self.archive_retention = load_retention()
+        self.archives = {}
+        # Columnar copy of every screener export, queryable without re-reading the CSVs
+        self.screener_store = ScreenerStore("screener_data")
+
+        # Opt-in metrics, see metrics_settings.json
+        settings = metrics.load_settings()
+        metrics.registry.configure(settings)
+        self.metrics_exporter = metrics.MetricsExporter(metrics.registry, settings["directory"], settings["interval"],
+                                                        settings["max_bytes"], settings["backups"])
+        self.metrics_exporter.start()
+
+    # Scheduling
+
+    def claim_schedule(self):
+        """ Become the process that runs the schedule. Returns False if the daemon or a window already is. """
+        try:
+            return self.schedule_lock.acquire()
+        except OSError as e:
+            print(f"Failed to lock the schedule: {e}")
+            return False
+
+    def load(self):
+        try:
+            for task in self.task_store.load():
+                self.scheduler.add(task)
+        except OSError as e:
+            print(f"Failed to load scheduled tasks: {e}")
+
+    def add_task(self, task):
+        """ Queue a task with the scheduler and journal it to disk. Returns its id. """
+        task_id = self.scheduler.add(task)
+        try:
+            with self._store_lock:
+                self.task_store.add_task(task)
+        except OSError as e:
+            print(f"Failed to save scheduled task: {e}")
+        self._schedule_changed()
+        return task_id
+
+    def cancel_task(self, task_id):
+        """ Cancel a scheduled task by id. Returns the task, or None if it was not scheduled. """
+        task = self.scheduler.cancel(task_id)
+        try:
+            with self._store_lock:
+                self.task_store.remove_task(task_id)
+        except OSError as e:
+            print(f"Failed to save scheduled task removal: {e}")
+        if task is not None:
+            self._schedule_changed()
+        return task
+
+    def cancel_by_name(self, task_name):
+        """ Cancel every scheduled run of a task name. Returns the cancelled tasks. """
+        cancelled = [task for task in self.scheduler.tasks() if task['task_name'] == task_name]
+        for task in cancelled:
+            self.cancel_task(task['id'])
+        return cancelled
+
+    def list_tasks(self):
+        return self.scheduler.tasks()
+
+    def run_due_tasks(self):
+        """ Start every due task on its own thread. Returns the number started. """
+        due_tasks = self.scheduler.pop_due()
+        for task, lateness in due_tasks:
+            print(f"Task {task['task_name']} fired {lateness:.3f}s late")
+            metrics.registry.histogram("schedule_lateness_seconds").observe(lateness)
+            try:
+                with self._store_lock:
+                    self.task_store.remove_task(task['id'])
+            except OSError as e:
+                print(f"Failed to save scheduled task removal: {e}")
+            if task.get('type') in ('browser', 'pipeline'):
+                # Browser tasks drive headless Chrome, not the input devices, so they run alongside replays.
+                # Pipelines queue their own replay stages on the executor.
+                threading.Thread(target=self.execute_task, args=(task, ReplayControl())).start()
+            else:
+                self.submit_replay(task)
+        if due_tasks:
+            self._schedule_changed()
+        return len(due_tasks)
+
+    def run_forever(self, stop_event):
+        """ Sleep until the next task is due (or the schedule changes) and run it, until stop_event is set. """
+        while not stop_event.is_set():
+            self.scheduler.wait(MAX_SCHEDULE_SLEEP)
+            if not stop_event.is_set():
+                self.run_due_tasks()
+
+    def _schedule_changed(self):
+        if self.on_schedule_changed is not None:
+            self.on_schedule_changed()
+
+    # Execution
+
+    def submit_replay(self, task, priority=PRIORITY_SCHEDULED, policy=None):
+        """ Queue the first repeat of a replay task on the input executor. Returns its InputJob.
+
+        Every repeat is a job of its own, and the next one is only submitted once the delay
+        between repeats has passed, so other replays can use the input devices in between.
+        The jobs share a frozen copy of the actions and of the current replay settings, so
+        later recordings or setting changes cannot reach them while they wait.
+        """
+        plan = dict(task, actions=freeze_plan(task.get('actions', [])))
+        settings = dict(self.replay_settings)
+        print(f"Executing task: {task['task_name']}")  # Debug print
+        return self.executor.submit(task['task_name'], self._repeat_job(plan, 0, settings, priority),
+                                    priority, policy=policy)
+
+    def _repeat_job(self, task, repeat_index, settings, priority):
+        """ The executor job for one repeat; it queues the next repeat to run after the delay. """
+        def run(job):
+            with metrics.registry.profiled("execute_task"), \
+                    metrics.registry.histogram("task_seconds", type="replay").time():
+                completed = self._replay_once(task, repeat_index, job, settings)
+            if completed and repeat_index < task["repeat"] - 1:
+                # Later repeats always queue: they continue this task rather than duplicate it
+                self.executor.submit_after(self._repeat_delay(task), task['task_name'],
+                                           self._repeat_job(task, repeat_index + 1, settings, priority),
+                                           priority, policy=POLICY_QUEUE)
+        return run
+
+    def execute_task(self, task, control=None, settings=None):
+        """ Run every repeat of a task on the calling thread. `control` (a ReplayControl or InputJob)
+        stops or pauses it. """
+        task_type = task.get('type', 'replay')
+        with metrics.registry.profiled("execute_task"), \
+                metrics.registry.histogram("task_seconds", type=task_type).time():
+            self._execute_task(task, control or ReplayControl(), self.replay_settings if settings is None else settings)
+
+    def _execute_task(self, task, control, settings):
+        print(f"Executing task: {task['task_name']}")  # Debug print
+        if task.get('type') == 'browser':
+            self.execute_browser_task(task, control)
+            return
+        if task.get('type') == 'pipeline':
+            self.execute_pipeline(task, control)
+            return
+        for i in range(task["repeat"]):
+            if not self._replay_once(task, i, control, settings):
+                return
+            if i < task["repeat"] - 1 and control.wait(self._repeat_delay(task)):
+                return
+
+    def _replay_once(self, task, repeat_index, control, settings):
+        """ Replay one repeat of a task and report it. Returns False if it was stopped or has no actions. """
+        if 'actions' not in task:
+            print(f"Task does not contain 'actions': {task}")
+            return False
+        locator = self.get_locator(task['task_name']) if settings.get("anchor") else None
+        started = time.time()
+        try:
+            if not self.replayer.replay(task["actions"], settings, locator, control):
+                self.record_run(task, repeat_index, 'stopped', started)
+                return False
+            self.record_run(task, repeat_index, 'success', started)  # Mark this repeat as successful
+        except Exception as e:
+            print(f"Error executing task: {e}")
+            self.record_run(task, repeat_index, 'error', started, str(e))  # Mark this repeat as failed
+        return True
+
+    @staticmethod
+    def _repeat_delay(task):
+        # A recording that starts by waiting for the screen needs no fixed pause between repeats
+        first_step = next((action for action in task["actions"] if action.get("action") != "mouseMove"), {})
+        return 0 if first_step.get("action") == "waitStable" else task["delay"]
+
+    def get_locator(self, task_name):
+        """ VisualLocator for the click anchors saved with a recording, or None if it has none. """
+        path = anchors_path(task_name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._locators.get(task_name)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, VisualLocator(AnchorSet.load(path)))
+            except Exception as e:
+                print(f"Failed to load click anchors for {task_name}: {e}")
+                return None
+            self._locators[task_name] = cached
+        return cached[1]
+
+    def execute_browser_task(self, task, control=None):
+        """ Download through a pooled headless browser and hand the files to the Downloads folder.
+        Stopping `control` (see stop_running) skips the remaining repeats. """
+        control = control or ReplayControl()
+        self._running_controls[id(control)] = (task['task_name'], control)
+        try:
+            for i in range(task["repeat"]):
+                started = time.time()
+                download_dir = None
+                try:
+                    download_dir = run_directory(self.driver_pool.download_root, task['task_name'])
+                    downloaded = run_browser_task(self.driver_pool, task['browser'], download_dir)
+                    for file_path in downloaded:
+                        destination = os.path.join(find_downloads_directory(), os.path.basename(file_path))
+                        shutil.move(file_path, destination)
+                        print(f"Downloaded {destination}")
+                    self.record_run(task, i, 'success', started)
+                except Exception as e:
+                    print(f"Error executing browser task: {e}")
+                    self.record_run(task, i, 'error', started, str(e))
+                finally:
+                    if download_dir is not None:
+                        shutil.rmtree(download_dir, ignore_errors=True)
+                if i < task["repeat"] - 1 and control.wait(task["delay"]):
+                    return
+        finally:
+            del self._running_controls[id(control)]
+
+    def execute_pipeline(self, task, control=None):
+        """ Run a task's pipeline of stages once per repeat. A repeat fails if any stage fails.
+        Stopping `control` (see stop_running) stops the running stages and the remaining repeats. """
+        control = control or ReplayControl()
+        self._running_controls[id(control)] = (task['task_name'], control)
+        try:
+            for i in range(task["repeat"]):
+                started = time.time()
+                try:
+                    runner = PipelineRunner(self, task['task_name'], task['pipeline'], control=control)
+                    if runner.run():
+                        self.record_run(task, i, 'success', started)
+                    elif runner.stopped:
+                        self.record_run(task, i, 'stopped', started, runner.errors())
+                        return
+                    else:
+                        self.record_run(task, i, 'error', started, runner.errors())
+                except Exception as e:
+                    print(f"Error executing pipeline: {e}")
+                    self.record_run(task, i, 'error', started, str(e))
+                if i < task["repeat"] - 1 and control.wait(task["delay"]):
+                    return
+        finally:
+            del self._running_controls[id(control)]
+
+    def stop_running(self, task_name=None):
+        """ Stop the running pipelines and browser tasks of a task name, or all of them.
+        Returns the number stopped. """
+        controls = [control for name, control in list(self._running_controls.values())
+                    if task_name is None or name == task_name]
+        for control in controls:
+            control.stop()
+        return len(controls)
+
+    def record_run(self, task, repeat_index, status, started, error=None):
+        """ Store one repeat in the run history and pass it to on_result. """
+        try:
+            self.history.record(task['task_name'], task.get('type', 'replay'), repeat_index, started,
+                                time.time() - started, status, error)
+        except sqlite3.Error as e:
+            print(f"Failed to record run history: {e}")
+        metrics.registry.counter("jobs_total", type=task.get('type', 'replay'), status=status).inc()
+        if self.on_result is not None:
+            self.on_result(task, repeat_index, status)
+
+    # File management
+
+    def move_csv_files(self):
+        """ Route the CSV files already in Downloads once. New downloads are handled by the watcher. """
+        try:
+            if not self.download_watcher.running:
+                self.download_watcher.route_existing()
+        except Exception as e:
+            print(f"An error occurred in move_csv_files: {e}")
+
+    def on_file_routed(self, path, rule):
+        # Runs on the watcher thread after a download has been moved into its folder
+        if path.lower().endswith(".csv"):
+            try:
+                added = self.screener_store.ingest(path, source=Path(rule["destination"]).name)
+                print(f"Ingested {added} new rows from {path}")
+            except Exception as e:
+                print(f"Failed to ingest {path}: {e}")
+        self.delete_old_files(rule["destination"])
+
+    def delete_old_files(self, directory):
+        """ Delete (or archive) all but the most recent files in the given directory. """
+        with metrics.registry.histogram("file_cleanup_seconds").time():
+            self._delete_old_files(directory)
+
+    def _delete_old_files(self, directory):
+        delete_seconds = metrics.registry.histogram("file_delete_seconds")
+        try:
+            directory = Path(directory)
+            files = [f for f in directory.iterdir() if f.is_file()]
+            if files:
+                files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
+                files_to_delete = files[1:]  # All but the most recent file
+                archive = self.get_archive(directory) if self.archive_mode else None
+                for file in files_to_delete:
+                    started = time.perf_counter()
+                    try:
+                        if archive is not None:
+                            if archive.add(file) is None:
+                                print(f"Skipped duplicate of an archived file: {file}")
+                            else:
+                                print(f"Archived old file: {file}")
+                        file.unlink()
+                        delete_seconds.observe(time.perf_counter() - started)
+                        print(f"Deleted old file: {file}")
+                    except Exception as e:
+                        print(f"Failed to delete {file}: {e}")
+        except Exception as e:
+            print(f"An error occurred in delete_old_files: {e}")
+
+    def get_archive(self, directory):
+        directory = Path(directory)
+        if directory not in self.archives:
+            self.archives[directory] = CsvArchive(directory, **self.archive_retention)
+        return self.archives[directory]
+
+    def close(self):
+        # Fold the journal back into scheduled_tasks.json on a clean exit, unless another process owns it
+        if self.schedule_lock.held:
+            try:
+                with self._store_lock:
+                    self.task_store.compact()
+            except OSError as e:
+                print(f"Failed to save scheduled tasks: {e}")
+        self.stop_running()
+        self.executor.close()
+        self.driver_pool.close()
+        self.download_watcher.stop()
+        self.metrics_exporter.stop()
+        self.history.close()
+        self.schedule_lock.release()
@@ -0,0 +1,296 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+RECORDING_SIZES = (1000, 10000, 100000, 1000000)
+SCHEDULE_SIZES = (10, 100, 1000, 10000, 100000)
+DIRECTORY_SIZES = (100, 1000, 10000)
+QUICK_RECORDING_SIZES = (1000, 10000)
+QUICK_SCHEDULE_SIZES = (10, 100, 1000)
+QUICK_DIRECTORY_SIZES = (100, 1000)
+# A result this much slower than the baseline is reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+
+class RecordingStub(types.ModuleType):
+    """ Stands in for pyautogui: counts calls instead of moving the real mouse. """
+
+    def __init__(self):
+        super().__init__("pyautogui")
+        self.calls = 0
+
+    def _record(self, *args, **kwargs):
+        self.calls += 1
+
+    moveTo = click = mouseDown = mouseUp = press = write = _record
+
+
+class _ListenerStub:
+    def __init__(self, **callbacks):
+        self.callbacks = callbacks
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def install_stubs():
+    """ Put stub pyautogui and pynput modules in sys.modules so nothing needs a display. """
+    pyautogui = RecordingStub()
+    pynput = types.ModuleType("pynput")
+    pynput.mouse = types.ModuleType("pynput.mouse")
+    pynput.keyboard = types.ModuleType("pynput.keyboard")
+    pynput.mouse.Listener = pynput.keyboard.Listener = _ListenerStub
+    sys.modules.update({"pyautogui": pyautogui, "pynput": pynput, "pynput.mouse": pynput.mouse,
+                        "pynput.keyboard": pynput.keyboard})
+    return pyautogui
+
+
+def synthetic_recording(count, seed=0):
+    """ A recording of `count` actions shaped like a real one: mostly mouse paths, some clicks and typing. """
+    rng = random.Random(seed)
+    actions = []
+    t, x, y = 0.0, 500, 500
+    while len(actions) < count:
+        kind = rng.random()
+        t += rng.uniform(0.005, 0.05)
+        if kind < 0.7:
+            x, y = x + rng.randint(-20, 20), y + rng.randint(-20, 20)
+            actions.append({"action": "mouseMove", "x": x, "y": y, "time": t})
+        elif kind < 0.85:
+            actions.append({"action": "mouseDown", "x": x, "y": y, "button": "left", "time": t})
+            actions.append({"action": "mouseUp", "x": x, "y": y, "button": "left", "time": t + 0.05})
+        else:
+            actions.append({"action": "keyPress", "key": rng.choice("abcdefghij"), "time": t})
+    return actions[:count]
+
+
+def synthetic_tasks(count, start, seed=0):
+    rng = random.Random(seed)
+    actions = synthetic_recording(50, seed)
+    return [{
+        'task_name': f"task{i % 20}",
+        'time': start + timedelta(seconds=rng.randint(0, 86400)),
+        'repeat': 1,
+        'delay': 0,
+        'actions': actions
+    } for i in range(count)]
+
+
+def fill_directory(directory, count, size=2048):
+    directory.mkdir(parents=True, exist_ok=True)
+    data = b"Ticker,Price,Change\n" + b"AAPL,1.0,0.5%\n" * (size // 14)
+    now = time.time()
+    for i in range(count):
+        path = directory / f"finviz_{i:06}.csv"
+        path.write_bytes(data)
+        os.utime(path, (now - i, now - i))
+
+
+def measure(function, repeat=3):
+    """ Median wall time of `function()` over `repeat` runs. Returns (seconds, last result). """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+class BenchmarkRun:
+    def __init__(self, workdir, repeat=3, out=sys.stdout):
+        self.workdir = Path(workdir)
+        self.repeat = repeat
+        self.out = out
+        self.results = {}
+
+    def record(self, name, seconds, items):
+        self.results[name] = {"seconds": seconds, "items": items,
+                              "per_item_us": seconds / items * 1e6 if items else None}
+        print(f"{name:<40}{seconds * 1000:12.2f} ms {self.results[name]['per_item_us'] or 0:10.3f} us/item",
+              file=self.out, flush=True)
+
+    def recordings(self, sizes):
+        from recording_format import RecordingReader, write_recording
+        from recording_catalog import RecordingCatalog
+        catalog = RecordingCatalog(str(self.workdir))
+        for size in sizes:
+            actions = synthetic_recording(size)
+            json_path = str(self.workdir / f"recording_{size}.json")
+            binary_path = str(self.workdir / f"recording_{size}.arec")
+
+            def save_json():
+                with open(json_path, 'w') as f:
+                    json.dump(actions, f, indent=4)
+
+            def load_json():
+                with open(json_path, 'r') as f:
+                    return json.load(f)
+
+            def load_binary():
+                reader = RecordingReader(binary_path)
+                try:
+                    return sum(1 for _ in reader)
+                finally:
+                    reader.close()
+
+            self.record(f"save_recording_json[{size}]", measure(save_json, self.repeat)[0], size)
+            self.record(f"load_recording_json[{size}]", measure(load_json, self.repeat)[0], size)
+            catalog.load(f"recording_{size}")
+            self.record(f"load_recording_cached[{size}]",
+                        measure(lambda: catalog.load(f"recording_{size}"), self.repeat)[0], size)
+            self.record(f"save_recording_arec[{size}]",
+                        measure(lambda: write_recording(actions, binary_path), self.repeat)[0], size)
+            self.record(f"load_recording_arec[{size}]", measure(load_binary, self.repeat)[0], size)
+
+    def replay(self, sizes, stub):
+        from replayer import Replayer
+        from replay_timing import MODE_FAST
+        replayer = Replayer()
+        for size in sizes:
+            actions = synthetic_recording(size)
+            for optimize in (False, True):
+                settings = {"mode": MODE_FAST, "delay": 0, "optimize": optimize}
+                stub.calls = 0
+                seconds, _ = measure(lambda: replayer.replay(actions, settings), self.repeat)
+                label = "optimized" if optimize else "raw"
+                self.record(f"replay_dispatch_{label}[{size}]", seconds, size)
+
+    def schedule(self, sizes):
+        from automation_service import AutomationService
+        for size in sizes:
+            directory = self.workdir / f"schedule_{size}"
+            directory.mkdir()
+            os.chdir(directory)
+            service = AutomationService()
+            # Due tasks are handed to a no-op so only the scheduling cost is measured
+            service.execute_task = lambda task, control=None, settings=None: None
+            service._replay_once = lambda task, repeat_index, control, settings: False
+            # Firing everything at once would otherwise hit the executor's admission limit
+            service.executor.settings["max_queued"] = None
+            tasks = synthetic_tasks(size, datetime.now() + timedelta(days=1))
+
+            seconds, _ = measure(lambda: [service.add_task(dict(task)) for task in tasks], 1)
+            self.record(f"schedule_add[{size}]", seconds, size)
+            self.record(f"save_scheduled_tasks[{size}]", measure(service.task_store.compact, self.repeat)[0], size)
+
+            ticks = 1000
+            seconds, _ = measure(lambda: [service.run_due_tasks() for _ in range(ticks)], self.repeat)
+            self.record(f"check_schedule_idle_tick[{size}]", seconds / ticks, 1)
+
+            # Jump the clock past every task so a single tick fires them all
+            later = datetime.now() + timedelta(days=3)
+            service.scheduler.clock = lambda: later
+            seconds, started = measure(service.run_due_tasks, 1)
+            self.record(f"check_schedule_fire_all[{size}]", seconds, started)
+            service.close()
+
+    def files(self, sizes):
+        from automation_service import AutomationService
+        from download_watcher import DownloadWatcher, default_rules
+        os.chdir(self.workdir)
+        service = AutomationService()
+        for size in sizes:
+            downloads = self.workdir / f"downloads_{size}"
+            desktop = self.workdir / f"desktop_{size}"
+            fill_directory(downloads, size)
+            watcher = DownloadWatcher(downloads, default_rules(desktop))
+            seconds, _ = measure(watcher.route_existing, 1)
+            self.record(f"move_csv_files[{size}]", seconds, size)
+            seconds, _ = measure(lambda: service.delete_old_files(desktop / "Finviz"), 1)
+            self.record(f"delete_old_files[{size}]", seconds, size)
+        service.close()
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Ratio of each result to the baseline, and the names that got slower by more than `threshold`. """
+    comparison, regressions = {}, []
+    for name, result in results.items():
+        if name not in baseline or not baseline[name]["seconds"]:
+            continue
+        ratio = result["seconds"] / baseline[name]["seconds"]
+        comparison[name] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time recording, replay, scheduling and file handling "
+                                                 "with stubbed input backends.")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the median is kept)")
+    parser.add_argument("--only", choices=["recordings", "replay", "schedule", "files"], action="append")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    stub = install_stubs()
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    output = Path(args.output).resolve()
+    baseline_path = Path(args.baseline).resolve()
+    only = args.only or ["recordings", "replay", "schedule", "files"]
+    recording_sizes = QUICK_RECORDING_SIZES if args.quick else RECORDING_SIZES
+    schedule_sizes = QUICK_SCHEDULE_SIZES if args.quick else SCHEDULE_SIZES
+    directory_sizes = QUICK_DIRECTORY_SIZES if args.quick else DIRECTORY_SIZES
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="automation_bench_") as workdir:
+        run = BenchmarkRun(workdir, args.repeat)
+        # The code under test prints per replay and per file, which would drown out the results
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if "recordings" in only:
+                    run.recordings(recording_sizes)
+                if "replay" in only:
+                    run.replay(recording_sizes, stub)
+                if "schedule" in only:
+                    run.schedule(schedule_sizes)
+                if "files" in only:
+                    run.files(directory_sizes)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "time": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": run.results
+    }
+    status = 0
+    if baseline_path.exists():
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)["results"]
+        report["comparison"], report["regressions"] = compare(run.results, baseline, args.threshold)
+        for name in report["regressions"]:
+            print(f"Regression: {name} is {report['comparison'][name]:.2f}x the baseline")
+        status = 1 if report["regressions"] else 0
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {output}")
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to {baseline_path}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import fnmatch
+import functools
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from download_watcher import PARTIAL_SUFFIXES
+
+
+def chrome_options(download_dir, headless=True):
+    """ Build ChromeOptions that download silently into `download_dir`. """
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option('prefs', {
+        "download.default_directory": download_dir,
+        "download.prompt_for_download": False,
+        "download.directory_upgrade": True,
+        "safe browsing.enabled": True
+    })
+    return options
+
+
+def make_chrome_driver(download_dir, headless=True):
+    from selenium import webdriver
+
+    return webdriver.Chrome(options=chrome_options(download_dir, headless))
+
+
+def set_download_directory(driver, download_dir):
+    """ Point an existing Chrome session at a new download directory without restarting it. """
+    os.makedirs(download_dir, exist_ok=True)
+    params = {"behavior": "allow", "downloadPath": os.path.abspath(download_dir)}
+    try:
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", params)
+    except Exception:
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", params)
+
+
+def wait_for_download(download_dir, existing=(), timeout=120, poll_interval=0.25, pattern=None):
+    """ Wait for new, fully written files to appear in `download_dir` and return their paths.
+
+    A file counts as finished once it no longer has a partial-download suffix and its size
+    has stayed the same across two polls. Raises TimeoutError if nothing finishes in time.
+    """
+    existing = set(existing)
+    deadline = time.monotonic() + timeout
+    sizes = {}
+    while time.monotonic() < deadline:
+        names = [name for name in os.listdir(download_dir) if name not in existing]
+        in_progress = any(name.endswith(PARTIAL_SUFFIXES) for name in names)
+        finished = []
+        for name in names:
+            if name.endswith(PARTIAL_SUFFIXES) or (pattern and not fnmatch.fnmatch(name, pattern)):
+                continue
+            path = os.path.join(download_dir, name)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if sizes.get(name) == size:
+                finished.append(path)
+            sizes[name] = size
+        if finished and not in_progress:
+            return finished
+        time.sleep(poll_interval)
+    raise TimeoutError(f"No download finished in {download_dir} within {timeout} seconds")
+
+
+class DriverPool:
+    """ Pool of warm WebDriver sessions shared by browser tasks.
+
+    Sessions are created on first use, up to `size`, and kept open between tasks so later
+    tasks skip browser start-up. `driver_factory` is called with a download directory and
+    can be swapped out to run tasks against something other than Chrome.
+    """
+
+    def __init__(self, size=2, driver_factory=make_chrome_driver, download_root=None):
+        self.size = size
+        self.driver_factory = driver_factory
+        self.download_root = download_root or os.path.join(os.path.expanduser("~"), "Downloads", "automation")
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        """ Take an idle session, start a new one if below `size`, or wait for one to be released. """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Driver pool is closed")
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self.driver_factory(self.download_root)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def release(self, driver, discard=False):
+        """ Return a session to the pool, or quit it if it is broken or the pool is closed. """
+        if discard or self._closed:
+            self._quit(driver)
+            return
+        self._idle.put(driver)
+
+    @contextmanager
+    def session(self, timeout=None):
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except TimeoutError:
+            raise
+        except Exception:
+            # The session may be in an unknown state, so don't hand it to the next task
+            broken = True
+            raise
+        finally:
+            self.release(driver, discard=broken)
+
+    def close(self):
+        """ Quit every idle session. Sessions still in use are quit when released. """
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+    def _quit(self, driver):
+        with self._lock:
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Failed to close browser session: {e}")
+
+
+def run_directory(download_root, name):
+    """ A new folder under download_root/<name> for one run, so runs of the same task at the same time
+    never pick up each other's downloads. """
+    parent = os.path.join(download_root, name)
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix="run-", dir=parent)
+
+
+def run_browser_task(pool, task, download_dir):
+    """ Run one browser task and return the paths of the files it downloaded.
+
+    A browser task is a dict with the page 'url', an optional list of CSS selectors to
+    'click' in order, an optional filename 'pattern' for the expected download, and an
+    optional 'timeout' in seconds.
+    """
+    from selenium.webdriver.common.by import By
+
+    os.makedirs(download_dir, exist_ok=True)
+    existing = os.listdir(download_dir)
+    with pool.session() as driver:
+        set_download_directory(driver, download_dir)
+        driver.get(task["url"])
+        for selector in task.get("click", []):
+            driver.find_element(By.CSS_SELECTOR, selector).click()
+        return wait_for_download(download_dir, existing, timeout=task.get("timeout", 120),
+                                 pattern=task.get("pattern"))
+
+
+def run_browser_tasks(pool, tasks, download_root):
+    """ Run several browser tasks concurrently, each in its own download directory.
+
+    Returns a dict of task name to downloaded paths, or to the exception the task raised.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {
+            task["name"]: executor.submit(run_browser_task, pool, task, os.path.join(download_root, task["name"]))
+            for task in tasks
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+    return results
+
+
+def start_csv_server(directory, port=0):
+    """ Serve the CSV files in `directory` as downloads on localhost, standing in for Finviz/TradingView.
+
+    Returns (server, base_url). Call server.shutdown() when finished.
+    """
+    # Only needed for trying tasks out, so http.server stays out of normal startup
+    import http.server
+
+    class AttachmentHandler(http.server.SimpleHTTPRequestHandler):
+        def end_headers(self):
+            if self.path.endswith(".csv"):
+                self.send_header("Content-Disposition", "attachment")
+            super().end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    handler = functools.partial(AttachmentHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
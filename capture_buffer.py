@@ -0,0 +1,53 @@
+import collections
+
+# Most events held between two drains before new ones are dropped
+DEFAULT_CAPACITY = 10000
+
+
+class CaptureBuffer:
+    """ Bounded hand-off between the pynput listener threads and the Tk main loop.
+
+    Listeners only push small tuples; deque.append and deque.popleft are atomic in
+    CPython, so neither side takes a lock. When the buffer is full new events are
+    dropped and counted rather than blocking the listener.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.queued = 0
+        self.dropped = 0
+        self._events = collections.deque()
+
+    def __len__(self):
+        return len(self._events)
+
+    def push(self, event):
+        if len(self._events) >= self.capacity:
+            self.dropped += 1
+            return False
+        self._events.append(event)
+        self.queued += 1
+        return True
+
+    def drain(self, limit=None):
+        """ Remove and return up to `limit` buffered events, oldest first. """
+        events = []
+        count = len(self._events) if limit is None else min(limit, len(self._events))
+        for _ in range(count):
+            events.append(self._events.popleft())
+        return events
+
+    def reset(self):
+        self._events.clear()
+        self.queued = 0
+        self.dropped = 0
+
+
+def event_to_action(event):
+    """ Turn a captured (action, x, y, name, time) tuple into a recorded action dict. """
+    action_type, x, y, name, timestamp = event
+    if action_type == "keyPress":
+        return {"action": action_type, "key": name, "time": timestamp}
+    if action_type in ("mouseMove", "waitStable"):
+        return {"action": action_type, "x": x, "y": y, "time": timestamp}
+    return {"action": action_type, "x": x, "y": y, "button": name, "time": timestamp}
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from task_store import atomic_write_json
+
+ARCHIVE_DIR_NAME = "archive"
+DEFAULT_RETENTION = {"keep": 1000, "max_age_days": 365, "max_bytes": 500 * 1024 * 1024}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_retention(path="archive_settings.json"):
+    """ Read retention overrides ({"keep", "max_age_days", "max_bytes"}) on top of the defaults. """
+    retention = dict(DEFAULT_RETENTION)
+    try:
+        with open(path, 'r') as f:
+            retention.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return retention
+
+
+class CsvArchive:
+    """ Compressed, deduplicated history of the screener CSVs in one folder.
+
+    Each file is gzip-compressed and appended to a segment for the day it was downloaded
+    (archive/YYYY-MM-DD.gz holds one gzip member per file). archive/index.json maps each day to
+    the byte ranges of its files and remembers every content hash, so byte-identical downloads
+    are skipped and a day can be read back without listing the directory. Retention removes
+    whole day segments, oldest first, so cleanup never touches the files that are kept.
+    """
+
+    def __init__(self, directory, keep=None, max_age_days=None, max_bytes=None):
+        self.root = Path(directory) / ARCHIVE_DIR_NAME
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.index_path = self.root / "index.json"
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r') as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {"days": {}, "hashes": {}, "total_bytes": 0}
+        return self._index
+
+    def add(self, path):
+        """ Archive a file. Returns its index entry, or None if identical content is already archived. """
+        path = Path(path)
+        sha256 = file_sha256(path)
+        with self._lock:
+            index = self.index
+            if sha256 in index["hashes"]:
+                return None
+            stat = path.stat()
+            day = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d")
+            self.root.mkdir(parents=True, exist_ok=True)
+            segment = self.root / f"{day}.gz"
+            compressed = gzip.compress(path.read_bytes())
+            with open(segment, 'ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {"name": path.name, "sha256": sha256, "offset": offset, "length": len(compressed),
+                     "size": stat.st_size, "modified": stat.st_mtime}
+            index["days"].setdefault(day, []).append(entry)
+            index["hashes"][sha256] = day
+            index["total_bytes"] += len(compressed)
+            self._apply_retention()
+            atomic_write_json(self.index_path, index)
+            return entry
+
+    def days(self):
+        return sorted(self.index["days"])
+
+    def entries(self, day):
+        """ Index entries archived for a day ("YYYY-MM-DD"), without touching the segment. """
+        return list(self.index["days"].get(day, []))
+
+    def read(self, day, name=None):
+        """ Return {file name: bytes} for the files archived on `day`, or just the one called `name`. """
+        result = {}
+        segment = self.root / f"{day}.gz"
+        with open(segment, 'rb') as f:
+            for entry in self.entries(day):
+                if name is not None and entry["name"] != name:
+                    continue
+                f.seek(entry["offset"])
+                result[entry["name"]] = gzip.decompress(f.read(entry["length"]))
+        return result
+
+    def _apply_retention(self):
+        index = self.index
+        days = sorted(index["days"])
+        total_files = sum(len(index["days"][day]) for day in days)
+        cutoff = None
+        if self.max_age_days is not None:
+            cutoff = (datetime.now() - timedelta(days=self.max_age_days)).strftime("%Y-%m-%d")
+        # Always keep the newest day so the archive never empties itself
+        for day in days[:-1]:
+            too_many = self.keep is not None and total_files > self.keep
+            too_big = self.max_bytes is not None and index["total_bytes"] > self.max_bytes
+            too_old = cutoff is not None and day < cutoff
+            if not (too_many or too_big or too_old):
+                break
+            entries = index["days"].pop(day)
+            total_files -= len(entries)
+            for entry in entries:
+                index["hashes"].pop(entry["sha256"], None)
+                index["total_bytes"] -= entry["length"]
+            try:
+                (self.root / f"{day}.gz").unlink()
+                print(f"Removed archived files from {day}")
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,266 @@
+import argparse
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from automation_service import AutomationService, load_browser_task, load_recording_actions
+from pipeline import load_pipeline
+
+# The control socket only listens on localhost
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 47653
+# Shared secret every request except ping must carry, rewritten on each daemon start and readable only by the user
+TOKEN_PATH = Path.home() / ".automation_daemon_token"
+
+
+def create_token(path=TOKEN_PATH):
+    token = secrets.token_hex(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    # The mode above only applies to a new file
+    os.chmod(path, 0o600)
+    return token
+
+
+def read_token(path=TOKEN_PATH):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def task_to_json(task, include_actions=False):
+    data = {key: value for key, value in task.items() if key != 'actions' or include_actions}
+    data['time'] = task['time'].isoformat()
+    return data
+
+
+def build_task(task_name, scheduled_time, repeat=1, delay=0, actions=None, catalog=None):
+    """ Build a scheduled task for a saved recording, browser task or pipeline definition.
+    With a catalog, tasks scheduled from the same recording share one parsed copy of it. """
+    task = {
+        'task_name': task_name,
+        'time': scheduled_time,
+        'repeat': repeat,
+        'delay': delay
+    }
+    browser_task = load_browser_task(task_name)
+    if browser_task is not None:
+        task.update({'type': 'browser', 'browser': browser_task, 'actions': []})
+        return task
+    pipeline = load_pipeline(task_name)
+    if pipeline is not None:
+        task.update({'type': 'pipeline', 'pipeline': pipeline, 'actions': []})
+        return task
+    if actions is None:
+        actions = catalog.load(task_name) if catalog is not None else load_recording_actions(task_name)
+        if actions is None:
+            raise ValueError(f"No recording found for task name: {task_name}")
+    task['actions'] = actions
+    return task
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """ One JSON request per line, one JSON response per line. """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                # Not a control client, e.g. a web page posting to localhost: drop the connection
+                return
+            if request.get("command") != "ping" and not self.server.authenticate(request.get("token")):
+                response = {"ok": False, "error": "Not authorized"}
+            else:
+                try:
+                    response = self.server.dispatch(request)
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, host=DAEMON_HOST, port=DAEMON_PORT, token=None):
+        super().__init__((host, port), _ControlHandler)
+        self.service = service
+        self.token = token
+
+    def authenticate(self, token):
+        return self.token is not None and isinstance(token, str) and hmac.compare_digest(token, self.token)
+
+    def dispatch(self, request):
+        command = request.get("command")
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if command == "list":
+            return {"ok": True, "tasks": [task_to_json(task) for task in self.service.list_tasks()],
+                    "lateness": self.service.scheduler.lateness.summary()}
+        if command == "add":
+            task = build_task(request["task_name"], datetime.fromisoformat(request["time"]),
+                              int(request.get("repeat", 1)), int(request.get("delay", 0)), request.get("actions"),
+                              self.service.catalog)
+            return {"ok": True, "id": self.service.add_task(task)}
+        if command == "cancel":
+            stopped = 0
+            if request.get("id"):
+                cancelled = [self.service.cancel_task(request["id"])]
+            else:
+                cancelled = self.service.cancel_by_name(request["task_name"])
+                # A pipeline or browser task of that name that already started is stopped as well
+                stopped = self.service.stop_running(request["task_name"])
+            cancelled = [task['id'] for task in cancelled if task is not None]
+            return {"ok": bool(cancelled) or bool(stopped), "cancelled": cancelled, "stopped": stopped}
+        if command == "recordings":
+            self.service.catalog.refresh()
+            return {"ok": True, "recordings": self.service.catalog.search(request.get("query") or "")}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+
+class DaemonClient:
+    """ Talks to a running daemon over its control socket. """
+
+    def __init__(self, host=DAEMON_HOST, port=DAEMON_PORT, timeout=5, token_path=TOKEN_PATH):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.token_path = token_path
+
+    def request(self, command, **fields):
+        with socket.create_connection(self.address, timeout=self.timeout) as connection:
+            # Read on every request, since the daemon writes a new token each time it starts
+            request = dict(fields, command=command, token=read_token(self.token_path))
+            connection.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            with connection.makefile('r', encoding='utf-8') as reply:
+                response = json.loads(reply.readline())
+        if not response.get("ok") and "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def ping(self):
+        """ Return True if a daemon is answering on the control socket. """
+        try:
+            return self.request("ping")["ok"]
+        except (OSError, ValueError, RuntimeError):
+            return False
+
+    def list_tasks(self):
+        response = self.request("list")
+        for task in response["tasks"]:
+            task['time'] = datetime.fromisoformat(task['time'])
+        return response["tasks"]
+
+    def add_task(self, task_name, scheduled_time, repeat=1, delay=0, actions=None):
+        fields = {"task_name": task_name, "time": scheduled_time.isoformat(), "repeat": repeat, "delay": delay}
+        if actions is not None:
+            fields["actions"] = actions
+        return self.request("add", **fields)["id"]
+
+    def cancel(self, task_name=None, task_id=None):
+        return self.request("cancel", task_name=task_name, id=task_id)["cancelled"]
+
+    def recordings(self, query=""):
+        return self.request("recordings", query=query)["recordings"]
+
+
+def serve(port=DAEMON_PORT, move_files=False, archive=False):
+    """ Run scheduled tasks headlessly until interrupted. Returns the exit status; refuses to run
+    while a window or another daemon runs the schedule. """
+    service = AutomationService()
+    if not service.claim_schedule():
+        owner = service.schedule_lock.owner()
+        print(f"The schedule is already run by another process{f' (pid {owner})' if owner else ''}; "
+              f"close the automation window or the other daemon first")
+        service.close()
+        return 1
+    service.archive_mode = archive
+    service.load()
+    if move_files:
+        service.download_watcher.start()
+    stop_event = threading.Event()
+    server = ControlServer(service, port=port, token=create_token())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def shut_down(signum, frame):
+        stop_event.set()
+        # Wake the scheduler so run_forever notices the stop right away
+        service.scheduler.wake()
+
+    signal.signal(signal.SIGINT, shut_down)
+    signal.signal(signal.SIGTERM, shut_down)
+    print(f"Automation daemon listening on {DAEMON_HOST}:{port} with {len(service.scheduler)} scheduled tasks")
+    try:
+        service.run_forever(stop_event)
+    finally:
+        server.shutdown()
+        service.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scheduled automation tasks without the window.")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the scheduler daemon")
+    serve_parser.add_argument("--move-files", action="store_true", help="route finished CSV downloads")
+    serve_parser.add_argument("--archive", action="store_true", help="archive old CSVs instead of deleting them")
+
+    add_parser = commands.add_parser("add", help="schedule a saved task")
+    add_parser.add_argument("task_name")
+    add_parser.add_argument("time", help="when to run, e.g. '2024-07-01 09:30'")
+    add_parser.add_argument("--repeat", type=int, default=1)
+    add_parser.add_argument("--delay", type=int, default=0, help="seconds between repeats")
+
+    commands.add_parser("list", help="show scheduled tasks")
+
+    recordings_parser = commands.add_parser("recordings", help="list saved recordings")
+    recordings_parser.add_argument("query", nargs="?", default="", help="only names containing this")
+
+    cancel_parser = commands.add_parser("cancel", help="cancel a scheduled task by name or id")
+    cancel_parser.add_argument("task")
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        return serve(args.port, args.move_files, args.archive)
+
+    client = DaemonClient(port=args.port)
+    try:
+        if args.command == "add":
+            task_id = client.add_task(args.task_name, datetime.fromisoformat(args.time), args.repeat, args.delay)
+            print(f"Scheduled {args.task_name} as {task_id}")
+        elif args.command == "list":
+            for task in client.list_tasks():
+                print(f"{task['id']}  {task['time']:%Y-%m-%d %H:%M:%S}  {task['task_name']}  "
+                      f"repeat {task['repeat']}  delay {task['delay']}s")
+        elif args.command == "recordings":
+            for entry in client.recordings(args.query):
+                print(f"{entry['name']}  {entry['format']}  {entry['actions']} actions  {entry['duration']}s")
+        elif args.command == "cancel":
+            cancelled = client.cancel(task_name=args.task) or client.cancel(task_id=args.task)
+            print(f"Cancelled {len(cancelled)} task(s)")
+    except OSError as e:
+        print(f"Could not reach the daemon on port {args.port}: {e}")
+        return 1
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
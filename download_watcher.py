@@ -0,0 +1,311 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import re
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import metrics
+
+# Suffixes browsers use while a download is still being written
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".tmp")
+# Seconds between passes that forget files which have left the folder
+SEEN_PRUNE_INTERVAL = 60.0
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def default_rules(desktop_dir=None):
+    """ The routing rules move_csv_files has always used: Finviz exports and TradingView screeners. """
+    desktop_dir = Path(desktop_dir) if desktop_dir else Path.home() / "Desktop"
+    return [
+        {"pattern": re.compile(r"^.*finviz.*\.csv$", re.IGNORECASE), "destination": desktop_dir / "Finviz"},
+        {"pattern": re.compile(r"^stock screener_\d{4}-\d{2}-\d{2}\.csv$", re.IGNORECASE),
+         "destination": desktop_dir / "TradingView"},
+    ]
+
+
+def load_rules(path="download_rules.json", desktop_dir=None):
+    """ Load routing rules from a JSON list of {"pattern": regex, "destination": folder}.
+
+    Relative destinations are taken relative to the Desktop. Falls back to default_rules()
+    when the file does not exist.
+    """
+    desktop_dir = Path(desktop_dir) if desktop_dir else Path.home() / "Desktop"
+    try:
+        with open(path, 'r') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return default_rules(desktop_dir)
+    return [{"pattern": re.compile(entry["pattern"], re.IGNORECASE),
+             "destination": desktop_dir / Path(entry["destination"]).expanduser()}
+            for entry in entries]
+
+
+def atomic_move(source, destination_dir):
+    """ Move a file into `destination_dir` so the destination name only ever holds a complete file. """
+    destination_dir = Path(destination_dir)
+    destination = destination_dir / Path(source).name
+    try:
+        os.replace(source, destination)
+    except OSError:
+        # Different file system: copy beside the destination, then rename into place
+        fd, temp_path = tempfile.mkstemp(prefix=".moving-", dir=destination_dir)
+        os.close(fd)
+        try:
+            shutil.copy2(source, temp_path)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.remove(source)
+    return destination
+
+
+class _Inotify:
+    """ Minimal ctypes binding for inotify watching one directory for finished files. """
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {directory}")
+
+    def read(self, timeout):
+        """ Return the names that were written or moved in, waiting up to `timeout` seconds. """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWaiter:
+    """ Handle returned by DownloadWatcher.expect(); wait() blocks until a matching file arrives. """
+
+    def __init__(self, pattern):
+        self.pattern = pattern.lower()
+        self.path = None
+        self._event = threading.Event()
+
+    def matches(self, name):
+        return fnmatch.fnmatch(name.lower(), self.pattern)
+
+    def wait(self, timeout=None):
+        """ Return the final path of the matching file. Raises TimeoutError if it doesn't arrive in time
+        and RuntimeError if the wait was cancelled. """
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"No file matching {self.pattern!r} arrived within {timeout} seconds")
+        if self.path is None:
+            raise RuntimeError(f"Wait for {self.pattern!r} was cancelled")
+        return self.path
+
+    def cancel(self):
+        """ Wake wait() without a file. """
+        self._event.set()
+
+    def _resolve(self, path):
+        self.path = path
+        self._event.set()
+
+
+class DownloadWatcher:
+    """ Watches the Downloads folder and routes finished files through a rule table.
+
+    Uses inotify on Linux and falls back to polling elsewhere. A file is handled once it has
+    no partial-download suffix, is not empty, has no partial download beside it (name.part etc.)
+    and its size has not changed for `settle` seconds. Matching
+    files are moved atomically to the first rule's destination and `on_file(path, rule)` is
+    called; anyone blocked in a FileWaiter for that name is woken with the final path.
+    With handle_existing=False, files already in the folder at start() are left alone.
+    """
+
+    def __init__(self, directory, rules=None, on_file=None, settle=0.5, poll_interval=2.0, handle_existing=True):
+        self.directory = str(directory)
+        self.rules = rules if rules is not None else default_rules()
+        self.on_file = on_file
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.handle_existing = handle_existing
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+        self._pending = {}
+        self._seen = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        if not self.handle_existing:
+            # Seen before the thread starts, so only files that are new or change afterwards count
+            for name in os.listdir(self.directory):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                self._seen[name] = (stat.st_size, stat.st_mtime_ns)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def expect(self, pattern):
+        """ Register interest in a file name glob before starting whatever will download it. """
+        waiter = FileWaiter(pattern)
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+        return waiter
+
+    def wait_for(self, pattern, timeout=None):
+        """ Block until a file matching `pattern` arrives and return its final path. """
+        return self.expect(pattern).wait(timeout)
+
+    def route_existing(self):
+        """ One pass over files already in the folder, for use without the background thread. """
+        for name in os.listdir(self.directory):
+            if not name.endswith(PARTIAL_SUFFIXES):
+                try:
+                    size = os.path.getsize(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                if not self._in_progress(name, size):
+                    self._handle(name)
+
+    def _in_progress(self, name, size):
+        # Firefox creates an empty file under the final name next to the .part it writes to
+        return size == 0 or any(os.path.exists(os.path.join(self.directory, name + suffix))
+                                for suffix in PARTIAL_SUFFIXES)
+
+    def _run(self):
+        try:
+            inotify = _Inotify(self.directory) if sys.platform.startswith("linux") else None
+        except OSError as e:
+            print(f"inotify unavailable, polling {self.directory} instead: {e}")
+            inotify = None
+        try:
+            # Files that landed before the watcher started
+            for name in os.listdir(self.directory):
+                self._track(name)
+            pruned = time.monotonic()
+            while not self._stop.is_set():
+                timeout = self.settle if self._pending else self.poll_interval
+                if inotify is not None:
+                    for name in inotify.read(timeout):
+                        self._track(name)
+                    names = None
+                else:
+                    self._stop.wait(timeout)
+                    names = os.listdir(self.directory)
+                    for name in names:
+                        self._track(name)
+                self._check_pending()
+                if time.monotonic() - pruned >= SEEN_PRUNE_INTERVAL:
+                    self._prune_seen(os.listdir(self.directory) if names is None else names)
+                    pruned = time.monotonic()
+        except Exception as e:
+            print(f"An error occurred in the download watcher: {e}")
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _track(self, name):
+        if name.endswith(PARTIAL_SUFFIXES) or name.startswith("."):
+            return
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        # Polling sees unmatched files on every pass; only look at them again if they change
+        if self._seen.get(name) == signature or name in self._pending:
+            return
+        self._pending[name] = (signature, time.monotonic())
+
+    def _prune_seen(self, names):
+        # Unmatched files stay put, so without this every name ever downloaded would be kept
+        present = set(names)
+        for name in [name for name in self._seen if name not in present]:
+            del self._seen[name]
+
+    def _check_pending(self):
+        now = time.monotonic()
+        for name, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                del self._pending[name]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature or self._in_progress(name, stat.st_size):
+                self._pending[name] = (current, now)
+            elif now - since >= self.settle:
+                del self._pending[name]
+                self._seen[name] = current
+                self._handle(name)
+
+    def _handle(self, name):
+        path = os.path.join(self.directory, name)
+        rule = next((rule for rule in self.rules if rule["pattern"].match(name)), None)
+        if rule is not None:
+            destination_dir = Path(rule["destination"])
+            try:
+                if not destination_dir.exists():
+                    destination_dir.mkdir(parents=True)
+                    print(f"Created directory: {destination_dir}")
+                with metrics.registry.histogram("file_move_seconds").time():
+                    path = str(atomic_move(path, destination_dir))
+                self._seen.pop(name, None)
+                print(f"Moved {name} to {destination_dir}")
+            except Exception as e:
+                print(f"Failed to move {name}: {e}")
+                return
+            if self.on_file is not None:
+                self.on_file(path, rule)
+        with self._waiters_lock:
+            matched = [waiter for waiter in self._waiters if waiter.matches(name)]
+            self._waiters = [waiter for waiter in self._waiters if waiter not in matched]
+        for waiter in matched:
+            waiter._resolve(path)
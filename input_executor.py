@@ -0,0 +1,273 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+
+import metrics
+from replayer import ReplayControl
+
+# What to do with a job whose key is already queued or running, or that waited longer than max_wait:
+# queue runs it anyway, coalesce folds it into the job already waiting, skip drops it
+POLICY_QUEUE = "queue"
+POLICY_COALESCE = "coalesce"
+POLICY_SKIP = "skip"
+POLICIES = (POLICY_QUEUE, POLICY_COALESCE, POLICY_SKIP)
+
+# Replays started from the window go ahead of scheduled ones
+PRIORITY_SCHEDULED = 0
+PRIORITY_INTERACTIVE = 10
+
+DEFAULT_SETTINGS = {
+    "policy": POLICY_QUEUE,
+    # Jobs waiting beyond this are rejected until the queue drains
+    "max_queued": 100,
+    # Seconds a job may wait behind others before the policy treats it as late; None never does
+    "max_wait": None
+}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STOPPED = "stopped"
+SKIPPED = "skipped"
+REJECTED = "rejected"
+
+
+def load_executor_settings(path="executor_settings.json"):
+    """ Read executor overrides ({"policy", "max_queued", "max_wait"}) on top of the defaults. """
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, 'r') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    if settings["policy"] not in POLICIES:
+        print(f"Unknown executor policy {settings['policy']!r}, using {POLICY_QUEUE}")
+        settings["policy"] = POLICY_QUEUE
+    return settings
+
+
+def freeze_plan(actions):
+    """ An immutable copy of the action sequence for one job, so later edits to the source cannot reach it.
+    Action dicts are shared; the replayer never modifies them. """
+    return actions if isinstance(actions, tuple) else tuple(actions)
+
+
+class InputJob(ReplayControl):
+    """ One unit of work for the input executor. `run(job)` does the work and should honour
+    job.stop_event and job.pause_event, e.g. by passing the job to Replayer.replay as its control. """
+
+    def __init__(self, job_id, name, run, priority, key, policy):
+        super().__init__()
+        self.id = job_id
+        self.name = name
+        self.run = run
+        self.priority = priority
+        self.key = key
+        self.policy = policy
+        self.state = QUEUED
+        self.error = None
+        # Jobs folded into this one by the coalesce policy
+        self.coalesced = 0
+        self.submitted = time.monotonic()
+        self.finished = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def wait_finished(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def _finish(self, state, error=None):
+        self.state = state
+        self.error = error
+        metrics.registry.counter("executor_jobs_total", state=state).inc()
+        self.finished.set()
+
+
+class InputExecutor:
+    """ The one thread allowed to drive the mouse and keyboard.
+
+    Jobs wait in a priority queue (highest priority first, then in submission order) and run
+    one at a time, so overlapping scheduled tasks and manual replays never fight over the
+    input devices. Admission is bounded by max_queued, and the policy decides what happens to
+    a job whose key is already queued or running, or that waited longer than max_wait.
+    submit_after() queues a job once a delay has passed without holding the worker meanwhile.
+    `on_job_finished(job)` is called on the worker thread after every job.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.on_job_finished = None
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._current = None
+        self._closed = False
+        self._thread = None
+        # Timers of submit_after() jobs still waiting out their delay, with their keys
+        self._delayed = {}
+
+    def submit(self, name, run, priority=PRIORITY_SCHEDULED, key=None, policy=None):
+        """ Queue `run(job)` and return its InputJob. A job refused by admission control comes back
+        already finished, with state "rejected" or "skipped", or the waiting job it was coalesced into. """
+        key = name if key is None else key
+        policy = policy or self.settings["policy"]
+        with self._condition:
+            job = InputJob(next(self._ids), name, run, priority, key, policy)
+            if self._closed:
+                job._finish(REJECTED, "executor closed")
+                return job
+            waiting = next((queued for _, _, queued in self._queue if queued.key == key), None)
+            busy = waiting is not None or (self._current is not None and self._current.key == key)
+            if busy and policy == POLICY_SKIP:
+                print(f"Skipping {name}: it is already queued or running")
+                job._finish(SKIPPED)
+                return job
+            if waiting is not None and policy == POLICY_COALESCE:
+                waiting.coalesced += 1
+                metrics.registry.counter("executor_jobs_total", state="coalesced").inc()
+                return waiting
+            max_queued = self.settings["max_queued"]
+            if max_queued is not None and len(self._queue) >= max_queued:
+                print(f"Rejecting {name}: {len(self._queue)} jobs are already waiting for the input devices")
+                job._finish(REJECTED, "queue full")
+                return job
+            heapq.heappush(self._queue, (-priority, job.id, job))
+            metrics.registry.gauge("executor_queue_depth").set(len(self._queue))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="input-executor", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job
+
+    def submit_after(self, seconds, name, run, priority=PRIORITY_SCHEDULED, key=None, policy=None):
+        """ Submit a job once `seconds` have passed. Until then cancel(key), cancel_delayed() and
+        stop_all() drop it. Returns False if the executor is closed. """
+        key = name if key is None else key
+
+        def fire():
+            with self._condition:
+                if self._delayed.pop(timer, None) is None:
+                    return
+            self.submit(name, run, priority, key, policy)
+
+        timer = threading.Timer(seconds, fire)
+        timer.daemon = True
+        with self._condition:
+            if self._closed:
+                return False
+            self._delayed[timer] = key
+        timer.start()
+        return True
+
+    def cancel_delayed(self, key=None):
+        """ Drop the submit_after() jobs with `key` (every one if None) that are still waiting out
+        their delay. Returns the number dropped. """
+        with self._condition:
+            timers = [timer for timer, delayed_key in self._delayed.items() if key is None or delayed_key == key]
+            for timer in timers:
+                del self._delayed[timer]
+        for timer in timers:
+            timer.cancel()
+        return len(timers)
+
+    @property
+    def current(self):
+        return self._current
+
+    def queued(self):
+        """ Waiting jobs in the order they will run. """
+        with self._condition:
+            return [job for _, _, job in sorted(self._queue)]
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queue) + (self._current is not None)
+
+    def cancel(self, key):
+        """ Drop the waiting and delayed jobs with `key` and stop the running one. Returns the number affected. """
+        delayed = self.cancel_delayed(key)
+        with self._condition:
+            cancelled = [job for _, _, job in self._queue if job.key == key]
+            self._queue = [entry for entry in self._queue if entry[2].key != key]
+            heapq.heapify(self._queue)
+            current = self._current
+        for job in cancelled:
+            job.stop()
+            job._finish(STOPPED)
+        if current is not None and current.key == key:
+            current.stop()
+            cancelled.append(current)
+        return len(cancelled) + delayed
+
+    def stop_all(self):
+        """ Drop every waiting and delayed job and stop the running one. """
+        self.cancel_delayed()
+        with self._condition:
+            cancelled = [job for _, _, job in self._queue]
+            self._queue = []
+            current = self._current
+        for job in cancelled:
+            job.stop()
+            job._finish(STOPPED)
+        if current is not None:
+            current.stop()
+
+    def close(self, timeout=5):
+        """ Refuse new jobs, stop the current one and let the worker exit. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.stop_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _next_job(self):
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if not self._queue:
+                return None
+            job = heapq.heappop(self._queue)[2]
+            metrics.registry.gauge("executor_queue_depth").set(len(self._queue))
+            self._current = job
+            return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            waited = time.monotonic() - job.submitted
+            metrics.registry.histogram("executor_wait_seconds").observe(waited)
+            max_wait = self.settings["max_wait"]
+            state, error = DONE, None
+            try:
+                if job.stopped:
+                    state = STOPPED
+                elif max_wait is not None and waited > max_wait and job.policy != POLICY_QUEUE:
+                    # Coalesced and skippable jobs that are this late would only replay stale input
+                    print(f"Skipping {job.name}: it waited {waited:.1f}s for the input devices")
+                    state = SKIPPED
+                else:
+                    job.state = RUNNING
+                    try:
+                        job.run(job)
+                        state = STOPPED if job.stopped else DONE
+                    except Exception as e:
+                        print(f"Input job {job.name} failed: {e}")
+                        state, error = FAILED, str(e)
+            finally:
+                # No longer current before anyone woken by _finish can submit the same key again
+                with self._condition:
+                    self._current = None
+                job._finish(state, error)
+            if self.on_job_finished is not None:
+                try:
+                    self.on_job_finished(job)
+                except Exception as e:
+                    print(f"Error in job callback: {e}")
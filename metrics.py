@@ -0,0 +1,283 @@
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "profile": False,
+    "directory": "metrics",
+    "interval": 15,
+    "max_bytes": 5 * 1024 * 1024,
+    "backups": 3
+}
+# Upper bounds in seconds, from sub-millisecond input calls up to slow file moves and late schedules
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0)
+
+
+def load_settings(path="metrics_settings.json"):
+    """ Read metrics overrides ({"enabled", "profile", "directory", "interval", ...}) on top of the defaults. """
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, 'r') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return settings
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        # Scheduled tasks replay on their own threads, so updates must not race
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {"value": self.value}
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self.max = 0
+
+    def set(self, value):
+        self.value = value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {"value": self.value, "max": self.max}
+
+
+class Histogram:
+    """ Counts observations into fixed buckets, Prometheus style (each bucket is "<= bound"). """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        # Per-bucket counts; "+Inf" holds the observations above the top bound
+        return {"count": self.count, "sum": self.sum,
+                "buckets": dict(zip(tuple(map(str, self.buckets)) + ("+Inf",), self.counts))}
+
+
+class _NullMetric:
+    """ Stands in for every metric while metrics are disabled, so call sites need no checks. """
+
+    value = 0
+    count = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    @contextmanager
+    def time(self):
+        yield
+
+
+NULL_METRIC = _NullMetric()
+
+
+class MetricsRegistry:
+    """ Named counters, gauges and histograms, each optionally split by labels.
+
+    While disabled every lookup returns NULL_METRIC, so instrumented code costs one method
+    call per event. Hot loops should look their metrics up once, outside the loop.
+    """
+
+    def __init__(self, enabled=False, profile=False, profile_dir="metrics/profiles"):
+        self.enabled = enabled
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # The outermost profiled block on a thread covers the nested ones
+        self._profiling = threading.local()
+
+    def configure(self, settings):
+        self.enabled = settings["enabled"]
+        self.profile = settings["profile"]
+        self.profile_dir = os.path.join(settings["directory"], "profiles")
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def _get(self, kind, name, labels):
+        if not self.enabled:
+            return NULL_METRIC
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, kind())
+        return metric
+
+    def items(self):
+        """ (name, labels, metric) for every metric, sorted by name. """
+        with self._lock:
+            entries = list(self._metrics.items())
+        return [(name, dict(labels), metric) for (name, labels), metric in sorted(entries, key=lambda e: e[0])]
+
+    def snapshot(self):
+        return {
+            "time": datetime.now().isoformat(),
+            "metrics": [dict(name=name, type=type(metric).__name__.lower(), labels=labels, **metric.snapshot())
+                        for name, labels, metric in self.items()]
+        }
+
+    @contextmanager
+    def profiled(self, name):
+        """ Run the block under cProfile when profiling is on and save the stats to <profile_dir>/<name>-<time>.prof. """
+        if not self.profile or getattr(self._profiling, "active", False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running (Python 3.12+ allows only one per process)
+            yield
+            return
+        self._profiling.active = True
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._profiling.active = False
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof"))
+            except OSError as e:
+                print(f"Failed to save profile for {name}: {e}")
+
+
+def _prometheus_labels(labels, extra=None):
+    labels = dict(labels, **(extra or {}))
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(registry):
+    """ Render the registry in the Prometheus text exposition format. """
+    lines = []
+    typed = set()
+    for name, labels, metric in registry.items():
+        if name not in typed:
+            kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+            lines.append(f"# TYPE {name} {kind}")
+            typed.add(name)
+        if isinstance(metric, Histogram):
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {metric.sum}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {metric.count}")
+        else:
+            lines.append(f"{name}{_prometheus_labels(labels)} {metric.value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """ Periodically appends a snapshot to metrics.jsonl (rotated by size) and rewrites metrics.prom. """
+
+    def __init__(self, registry, directory="metrics", interval=15, max_bytes=5 * 1024 * 1024, backups=3):
+        self.registry = registry
+        self.directory = Path(directory)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.jsonl_path = self.directory / "metrics.jsonl"
+        self.prometheus_path = self.directory / "metrics.prom"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.registry.enabled:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.export()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._rotate()
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(self.registry.snapshot()) + "\n")
+            # Written whole and swapped in so a scraper never sees half a file
+            temp_path = self.prometheus_path.with_suffix(".prom.tmp")
+            temp_path.write_text(prometheus_text(self.registry))
+            os.replace(temp_path, self.prometheus_path)
+        except OSError as e:
+            print(f"Failed to export metrics: {e}")
+
+    def _rotate(self):
+        if not self.jsonl_path.exists() or self.jsonl_path.stat().st_size < self.max_bytes:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            older = Path(f"{self.jsonl_path}.{index}")
+            if older.exists():
+                os.replace(older, f"{self.jsonl_path}.{index + 1}")
+        if self.backups:
+            os.replace(self.jsonl_path, f"{self.jsonl_path}.1")
+        else:
+            self.jsonl_path.unlink()
+
+
+# Shared by every module; configured from metrics_settings.json at startup
+registry = MetricsRegistry()
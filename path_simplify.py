@@ -0,0 +1,120 @@
+import math
+
+
+def _distance_to_segment(point, start, end):
+    px, py = point[0], point[1]
+    sx, sy = start[0], start[1]
+    ex, ey = end[0], end[1]
+    dx, dy = ex - sx, ey - sy
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return math.hypot(px - sx, py - sy)
+    t = max(0.0, min(1.0, ((px - sx) * dx + (py - sy) * dy) / length_sq))
+    return math.hypot(px - (sx + t * dx), py - (sy + t * dy))
+
+
+def simplify_path(points, epsilon):
+    """ Ramer-Douglas-Peucker simplification of (x, y, time) points. Keeps both end points. """
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = None, epsilon
+        for index in range(first + 1, last):
+            distance = _distance_to_segment(points[index], points[first], points[last])
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+class MoveSimplifier:
+    """ Streaming mouse path simplifier.
+
+    Points closer than `min_distance` pixels or `min_interval` seconds to the last accepted
+    point are coalesced away, then accepted points are simplified with RDP over windows of
+    `window` points. The last point of each window starts the next one so the path stays joined.
+    """
+
+    def __init__(self, min_distance=3, min_interval=0.01, epsilon=2.0, window=32):
+        self.min_distance = min_distance
+        self.min_interval = min_interval
+        self.epsilon = epsilon
+        self.window = window
+        self.raw_points = 0
+        self.kept_points = 0
+        self._pending = []
+        self._last = None
+
+    def add(self, x, y, timestamp):
+        """ Feed one raw point. Returns the simplified points that are now final. """
+        self.raw_points += 1
+        if self._last is not None:
+            moved = math.hypot(x - self._last[0], y - self._last[1])
+            if moved < self.min_distance or timestamp - self._last[2] < self.min_interval:
+                return []
+        self._last = (x, y, timestamp)
+        self._pending.append(self._last)
+        if len(self._pending) < self.window:
+            return []
+        simplified = simplify_path(self._pending, self.epsilon)
+        self._pending = [simplified[-1]]
+        return self._emit(simplified[:-1])
+
+    def flush(self):
+        """ Emit everything still buffered, e.g. before a click or when recording stops. """
+        simplified = simplify_path(self._pending, self.epsilon)
+        self._pending = []
+        self._last = None
+        return self._emit(simplified)
+
+    def _emit(self, points):
+        self.kept_points += len(points)
+        return points
+
+    @property
+    def compression_ratio(self):
+        """ Raw points per kept point (1.0 when nothing has been recorded). """
+        return self.raw_points / self.kept_points if self.kept_points else 1.0
+
+    def reset(self):
+        self.raw_points = 0
+        self.kept_points = 0
+        self._pending = []
+        self._last = None
+
+
+def interpolate_moves(actions, step=10):
+    """ Yield the actions with extra mouseMove points every `step` pixels between consecutive moves.
+
+    Timestamps of the inserted points are interpolated linearly, so timed replay glides along
+    the simplified polyline instead of jumping from vertex to vertex. Inserted points have
+    'count' 0 since they stand for no recorded action.
+    """
+    previous = None
+    for action in actions:
+        if action.get("action") != "mouseMove":
+            previous = None
+            yield action
+            continue
+        if previous is not None:
+            dx, dy = action["x"] - previous["x"], action["y"] - previous["y"]
+            segments = int(math.hypot(dx, dy) // step)
+            start_time, end_time = previous.get("time"), action.get("time")
+            for index in range(1, segments):
+                fraction = index / segments
+                point = {"action": "mouseMove",
+                         "x": round(previous["x"] + dx * fraction),
+                         "y": round(previous["y"] + dy * fraction),
+                         "count": 0}
+                if start_time is not None and end_time is not None:
+                    point["time"] = start_time + (end_time - start_time) * fraction
+                yield point
+        previous = action
+        yield action
@@ -0,0 +1,337 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import metrics
+from download_watcher import DownloadWatcher, atomic_move
+from input_executor import DONE, PRIORITY_SCHEDULED, STOPPED, freeze_plan
+
+STAGE_TYPES = ("replay", "browser", "wait_file", "move", "ingest", "archive", "shell")
+# Fields a stage of each type cannot run without
+REQUIRED_FIELDS = {"browser": ("task",), "wait_file": ("pattern",), "move": ("destination",), "shell": ("command",)}
+# Stages that are only waiting on files, browsers or other processes run side by side
+PIPELINE_WORKERS = 4
+DEFAULT_RETRIES = 0
+# Seconds before the first retry of a stage; doubled for every retry after it
+DEFAULT_BACKOFF = 5.0
+DEFAULT_FILE_TIMEOUT = 600
+# How often a running pipeline checks whether its control was stopped
+STOP_POLL_SECONDS = 0.5
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+# A stage interrupted by stop() ends in STOPPED, like a stopped executor job
+
+
+def parse_stages(definition):
+    """ Check a pipeline definition and return its stages in dependency order, with "after" filled in.
+
+    A stage without "after" waits for the stage listed before it, so a plain list runs in
+    order; "after": [] starts a stage right away. Raises ValueError for unknown stage types,
+    missing required fields, duplicate or unknown names and dependency cycles.
+    """
+    stages = []
+    names = set()
+    for position, stage in enumerate(definition.get("stages", [])):
+        stage = dict(stage)
+        stage.setdefault("name", f"{stage.get('type')}_{position}")
+        if stage.get("type") not in STAGE_TYPES:
+            raise ValueError(f"Stage {stage['name']} has unknown type {stage.get('type')!r}")
+        missing = [field for field in REQUIRED_FIELDS.get(stage["type"], ()) if not stage.get(field)]
+        if missing:
+            raise ValueError(f"Stage {stage['name']} ({stage['type']}) is missing {', '.join(missing)}")
+        if stage["name"] in names:
+            raise ValueError(f"Stage name {stage['name']} is used twice")
+        names.add(stage["name"])
+        if "after" not in stage:
+            stage["after"] = [stages[-1]["name"]] if stages else []
+        elif isinstance(stage["after"], str):
+            stage["after"] = [stage["after"]]
+        stages.append(stage)
+    if not stages:
+        raise ValueError("Pipeline has no stages")
+    for stage in stages:
+        for dependency in stage["after"]:
+            if dependency not in names:
+                raise ValueError(f"Stage {stage['name']} waits for unknown stage {dependency}")
+
+    # Kahn's algorithm; anything left over is part of a cycle
+    remaining = {stage["name"]: set(stage["after"]) for stage in stages}
+    order = []
+    while True:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            break
+        order.extend(ready)
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    if remaining:
+        raise ValueError(f"Stages {', '.join(sorted(remaining))} depend on each other")
+    return sorted(stages, key=lambda stage: order.index(stage["name"]))
+
+
+def load_pipeline(task_name, directory="pipelines"):
+    """ Return the checked pipeline definition in pipelines/<task_name>.json, or None. """
+    file_path = os.path.join(directory, f"{task_name}.json")
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r') as f:
+        definition = json.load(f)
+    parse_stages(definition)
+    return definition
+
+
+class PipelineRunner:
+    """ Runs one pipeline: each stage starts as soon as the stages it waits for have succeeded.
+
+    Stages pass files along: a stage's inputs are the files output by the stages it waits for.
+    Replay stages queue on the service's input executor like any other replay; the other
+    stages run on a small thread pool, so a download wait, a browser task and a shell command
+    that don't depend on each other overlap. A stage that raises is retried after an
+    exponential backoff; once it runs out of retries, the stages after it are skipped.
+    stop(), stopping `control` or stopping one of its replay jobs (e.g. with "Stop Replay")
+    ends the stages that are running without retrying them and skips the rest.
+    """
+
+    def __init__(self, service, name, definition, workers=PIPELINE_WORKERS, control=None):
+        self.service = service
+        self.name = name
+        self.stages = {stage["name"]: stage for stage in parse_stages(definition)}
+        self.workers = workers
+        self.control = control
+        self.results = {name: {"state": PENDING, "attempts": 0, "seconds": 0.0, "outputs": [], "error": None}
+                        for name in self.stages}
+        self.stop_event = threading.Event()
+        self._jobs = {}
+        # Watcher the wait_file stages listen on, and the one started just for this run (if any)
+        self._file_watcher = None
+        self._watcher = None
+        self._waiters = {}
+        # Per-run download folders of browser stages, removed at the end once later stages moved the files out
+        self._download_dirs = []
+
+    def stop(self):
+        self.stop_event.set()
+        for job in list(self._jobs.values()):
+            job.stop()
+        for waiter in list(self._waiters.values()):
+            waiter.cancel()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    @property
+    def succeeded(self):
+        return all(result["state"] == SUCCEEDED for result in self.results.values())
+
+    def errors(self):
+        return "; ".join(f"{name}: {result['error']}" for name, result in self.results.items() if result["error"])
+
+    def run(self):
+        """ Run every stage and return True if all of them succeeded. """
+        started = time.monotonic()
+        self._start_file_waits()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"pipeline-{self.name}") as pool:
+                running = {}
+                while True:
+                    for name in self._ready():
+                        self.results[name]["state"] = RUNNING
+                        running[pool.submit(self._run_stage, name)] = name
+                    if not running:
+                        break
+                    finished, _ = wait(running, timeout=STOP_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    if self.control is not None and self.control.stopped and not self.stopped:
+                        self.stop()
+                    for future in finished:
+                        del running[future]
+        finally:
+            self._stop_file_waits()
+            for directory in self._download_dirs:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        print(f"Pipeline {self.name} finished in {time.monotonic() - started:.1f}s: " +
+              ", ".join(f"{name} {result['state']}" for name, result in self.results.items()))
+        return self.succeeded
+
+    def _ready(self):
+        """ Pending stages whose inputs are all ready. Stages after a failure are marked skipped. """
+        ready = []
+        # Stages are checked in dependency order, so a skip reaches everything downstream in one pass
+        for name, stage in self.stages.items():
+            if self.results[name]["state"] != PENDING:
+                continue
+            states = [self.results[dependency]["state"] for dependency in stage["after"]]
+            if any(state in (FAILED, SKIPPED, STOPPED) for state in states) or self.stopped:
+                self.results[name]["state"] = SKIPPED
+            elif all(state == SUCCEEDED for state in states):
+                ready.append(name)
+        return ready
+
+    def _run_stage(self, name):
+        stage = self.stages[name]
+        result = self.results[name]
+        inputs = [path for dependency in stage["after"] for path in self.results[dependency]["outputs"]]
+        retries = stage.get("retries", DEFAULT_RETRIES)
+        backoff = stage.get("backoff", DEFAULT_BACKOFF)
+        started = time.monotonic()
+        while True:
+            result["attempts"] += 1
+            try:
+                with metrics.registry.histogram("pipeline_stage_seconds", type=stage["type"]).time():
+                    result["outputs"] = getattr(self, f"_stage_{stage['type']}")(stage, inputs)
+                result["state"] = SUCCEEDED
+                result["error"] = None
+                break
+            except Exception as e:
+                result["error"] = str(e)
+                if self.stopped:
+                    print(f"Pipeline {self.name} stage {name} stopped")
+                    result["state"] = STOPPED
+                    break
+                if result["attempts"] > retries:
+                    print(f"Pipeline {self.name} stage {name} failed: {e}")
+                    result["state"] = FAILED
+                    break
+                delay = backoff * 2 ** (result["attempts"] - 1)
+                print(f"Pipeline {self.name} stage {name} failed ({e}), retrying in {delay:g}s")
+                if self.stop_event.wait(delay):
+                    result["state"] = STOPPED
+                    break
+        result["seconds"] = time.monotonic() - started
+        metrics.registry.counter("pipeline_stages_total", type=stage["type"], state=result["state"]).inc()
+
+    # File waits
+
+    def _start_file_waits(self):
+        """ Register every wait_file stage before anything runs, so a download that lands early is not missed. """
+        stages = [stage for stage in self.stages.values() if stage["type"] == "wait_file"]
+        if not stages:
+            return
+        watcher = self.service.download_watcher
+        if not watcher.running:
+            # Only report arrivals; files are moved by move stages, not by the routing rules
+            watcher = DownloadWatcher(watcher.directory, rules=[], handle_existing=False)
+            watcher.start()
+            self._watcher = watcher
+        for stage in stages:
+            self._waiters[stage["name"]] = watcher.expect(stage["pattern"])
+        self._file_watcher = watcher
+
+    def _stop_file_waits(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    # Stages. Each takes the stage definition and its input files and returns its output files.
+
+    def _stage_replay(self, stage, inputs):
+        service = self.service
+        recording = stage.get("recording", self.name)
+        actions = service.catalog.load(recording)
+        if actions is None:
+            raise ValueError(f"No recording found for {recording}")
+        plan = freeze_plan(actions)
+        settings = dict(service.replay_settings)
+        locator = service.get_locator(recording) if settings.get("anchor") else None
+
+        def replay(job):
+            for _ in range(stage.get("repeat", 1)):
+                if not service.replayer.replay(plan, settings, locator, job):
+                    return
+
+        job = service.executor.submit(f"{self.name}/{stage['name']}", replay, stage.get("priority", PRIORITY_SCHEDULED))
+        self._jobs[stage["name"]] = job
+        try:
+            job.wait_finished()
+        finally:
+            del self._jobs[stage["name"]]
+        if job.state == STOPPED:
+            # Stopped from outside, e.g. with "Stop Replay": the whole pipeline stops rather than retrying
+            self.stop()
+        if job.state != DONE:
+            raise RuntimeError(f"replay {job.state}" + (f": {job.error}" if job.error else ""))
+        return inputs
+
+    def _stage_browser(self, stage, inputs):
+        from browser_pool import run_browser_task, run_directory
+        from automation_service import load_browser_task
+        browser_task = load_browser_task(stage["task"])
+        if browser_task is None:
+            raise ValueError(f"No browser task named {stage['task']}")
+        download_dir = run_directory(self.service.driver_pool.download_root, stage["task"])
+        self._download_dirs.append(download_dir)
+        return [str(path) for path in run_browser_task(self.service.driver_pool, browser_task, download_dir)]
+
+    def _stage_wait_file(self, stage, inputs):
+        # A retry keeps listening on the waiter that timed out, so a file landing in between is not missed
+        waiter = self._waiters[stage["name"]]
+        if self.stopped:
+            waiter.cancel()
+        return [waiter.wait(stage.get("timeout", DEFAULT_FILE_TIMEOUT))]
+
+    def _stage_move(self, stage, inputs):
+        # Relative destinations are on the Desktop, like the download routing rules
+        destination = Path.home() / "Desktop" / Path(stage["destination"]).expanduser()
+        destination.mkdir(parents=True, exist_ok=True)
+        moved = []
+        for path in inputs:
+            if Path(path).parent == destination:
+                moved.append(path)
+                continue
+            with metrics.registry.histogram("file_move_seconds").time():
+                moved.append(str(atomic_move(path, destination)))
+            print(f"Moved {path} to {destination}")
+        return moved
+
+    def _stage_ingest(self, stage, inputs):
+        for path in inputs:
+            if path.lower().endswith(".csv"):
+                added = self.service.screener_store.ingest(path, source=stage.get("source") or Path(path).parent.name)
+                print(f"Ingested {added} new rows from {path}")
+        return inputs
+
+    def _stage_archive(self, stage, inputs):
+        for path in inputs:
+            if self.service.get_archive(Path(path).parent).add(path) is None:
+                print(f"Skipped duplicate of an archived file: {path}")
+            else:
+                print(f"Archived {path}")
+        return inputs
+
+    def _stage_shell(self, stage, inputs):
+        # The input files are passed on in PIPELINE_FILES, separated like PATH entries
+        env = dict(os.environ, PIPELINE_FILES=os.pathsep.join(inputs))
+        process = subprocess.Popen(stage["command"], shell=True, env=env, cwd=stage.get("cwd"),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        timeout = stage.get("timeout")
+        started = time.monotonic()
+        # Poll so stop() can end a long command instead of waiting for it or its timeout
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=STOP_POLL_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                if self.stopped or (timeout is not None and time.monotonic() - started >= timeout):
+                    process.kill()
+                    process.communicate()
+                    if self.stopped:
+                        raise RuntimeError("command killed, pipeline stopped")
+                    raise RuntimeError(f"command timed out after {timeout}s")
+        if stdout:
+            print(stdout.rstrip())
+        if process.returncode != 0:
+            raise RuntimeError(f"exit status {process.returncode}: {stderr.strip()[-200:]}")
+        return inputs
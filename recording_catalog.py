@@ -0,0 +1,271 @@
+import collections
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from recording_format import BINARY_EXTENSION, RecordingReader
+from task_store import atomic_write_json
+
+# Kept beside the recordings; the leading dot keeps it from being listed as a recording itself
+INDEX_NAME = ".index.json"
+# Parsed recordings are kept in memory until they hold this many actions in total
+CACHE_MAX_ACTIONS = 1000000
+# A recording saved in both formats is read from the compact one, as everywhere else
+FORMATS = ((BINARY_EXTENSION, "arec"), (".json", "json"))
+
+_Cached = collections.namedtuple("_Cached", "path stamp digest actions")
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def _stamp(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _duration(first, last):
+    if "time" in first and "time" in last:
+        return round(last["time"] - first["time"], 3)
+    return None
+
+
+class RecordingCatalog:
+    """ Index of the recordings in recordings/ plus an LRU cache of parsed recordings.
+
+    The index (recordings/.index.json) holds name, format, action count, duration, content
+    hash, created and modified time per recording, so listing and searching never open
+    a recording. load() returns the parsed actions from the cache while the file's mtime and
+    size are unchanged; a touched file whose content hash still matches is not parsed again.
+    The returned lists are shared between callers and must not be modified.
+    """
+
+    def __init__(self, directory="recordings", max_actions=CACHE_MAX_ACTIONS):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.max_actions = max_actions
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._cached_actions = 0
+        self._index = None
+        self._index_stamp = None
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, name):
+        """ Path and format of the saved recording for a task name, or (None, None). """
+        for extension, file_format in FORMATS:
+            path = os.path.join(self.directory, f"{name}{extension}")
+            if os.path.exists(path):
+                return path, file_format
+        return None, None
+
+    # Index
+
+    def _read_index(self):
+        # Re-read only when another process (the daemon or the window) rewrote it
+        try:
+            stamp = _stamp(os.stat(self.index_path))
+        except OSError:
+            stamp = None
+        if self._index is None or stamp != self._index_stamp:
+            self._index = {}
+            if stamp is not None:
+                try:
+                    with open(self.index_path, 'r') as f:
+                        self._index = json.load(f)["recordings"]
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Failed to read the recording index, rebuilding it: {e}")
+                    self._index = {}
+                    stamp = None
+            self._index_stamp = stamp
+        return self._index
+
+    def _write_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            atomic_write_json(self.index_path, {"version": 1, "recordings": self._index})
+            self._index_stamp = _stamp(os.stat(self.index_path))
+        except OSError as e:
+            print(f"Failed to save the recording index: {e}")
+
+    def list(self):
+        """ Index entries for every known recording, by name. """
+        with self._lock:
+            return [dict(entry) for name, entry in sorted(self._read_index().items())]
+
+    def search(self, text):
+        """ Index entries whose name contains `text`, ignoring case. """
+        text = text.lower()
+        return [entry for entry in self.list() if text in entry["name"].lower()]
+
+    def get(self, name):
+        with self._lock:
+            entry = self._read_index().get(name)
+            return dict(entry) if entry is not None else None
+
+    def _entry(self, name, path, file_format, stat, digest, count, duration):
+        previous = self._read_index().get(name, {})
+        return {
+            "name": name,
+            "format": file_format,
+            "actions": count,
+            "duration": duration,
+            "hash": digest,
+            "created": previous.get("created", getattr(stat, "st_birthtime", stat.st_ctime)),
+            "modified": stat.st_mtime,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns
+        }
+
+    def _store_entry(self, entry):
+        # Caller holds the lock
+        index = self._read_index()
+        if index.get(entry["name"]) != entry:
+            index[entry["name"]] = entry
+            self._write_index()
+
+    def _describe(self, name, path, file_format):
+        """ Index entry for one file. Compact recordings are described without decoding every action. """
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if file_format == "arec":
+            reader = RecordingReader(path)
+            try:
+                count = len(reader)
+                duration = _duration(reader[0], reader[-1]) if count else None
+            finally:
+                reader.close()
+        else:
+            actions = json.loads(data)
+            count = len(actions)
+            duration = _duration(actions[0], actions[-1]) if actions else None
+        return self._entry(name, path, file_format, stat, content_hash(data), count, duration)
+
+    def update(self, name):
+        """ Re-index one recording after it was saved. Returns its entry, or None if it has no file. """
+        path, file_format = self.path_for(name)
+        if path is None:
+            self.remove(name)
+            return None
+        entry = self._describe(name, path, file_format)
+        with self._lock:
+            self._store_entry(entry)
+        return entry
+
+    def remove(self, name):
+        """ Forget a deleted recording. """
+        with self._lock:
+            self._drop(name)
+            if self._read_index().pop(name, None) is not None:
+                self._write_index()
+
+    def refresh(self):
+        """ Bring the index up to date with the directory. Only files whose mtime or size changed are read.
+        Returns the number of entries added, updated or removed. """
+        try:
+            file_names = os.listdir(self.directory)
+        except FileNotFoundError:
+            file_names = []
+        names = set()
+        for file_name in file_names:
+            if file_name.startswith("."):
+                continue
+            for extension, _ in FORMATS:
+                if file_name.endswith(extension):
+                    names.add(file_name[:-len(extension)])
+        changed = 0
+        with self._lock:
+            index = self._read_index()
+            for name in list(index):
+                if name not in names:
+                    del index[name]
+                    self._drop(name)
+                    changed += 1
+        for name in sorted(names):
+            path, file_format = self.path_for(name)
+            if path is None:
+                continue
+            with self._lock:
+                entry = self._read_index().get(name)
+            try:
+                stat = os.stat(path)
+                if entry is not None and entry["format"] == file_format and \
+                        (entry["mtime_ns"], entry["size"]) == _stamp(stat):
+                    continue
+                entry = self._describe(name, path, file_format)
+            except (OSError, ValueError) as e:
+                print(f"Skipping recording {name}: {e}")
+                continue
+            with self._lock:
+                self._read_index()[name] = entry
+            changed += 1
+        if changed:
+            with self._lock:
+                self._write_index()
+        return changed
+
+    # Parsed recordings
+
+    def load(self, name):
+        """ The actions of a saved recording as a list, or None if there is none. """
+        path, file_format = self.path_for(name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and cached.path == path and cached.stamp == _stamp(stat):
+                self._cache.move_to_end(name)
+                self.hits += 1
+                return cached.actions
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = content_hash(data)
+        with self._lock:
+            # Saved again with the same content: keep the parsed copy
+            if cached is not None and cached.path == path and cached.digest == digest:
+                self._cache[name] = cached._replace(stamp=_stamp(stat))
+                self._cache.move_to_end(name)
+                self.hits += 1
+                return cached.actions
+        self.misses += 1
+        if file_format == "arec":
+            reader = RecordingReader(path)
+            try:
+                actions = list(reader)
+            finally:
+                reader.close()
+        else:
+            actions = json.loads(data)
+        duration = _duration(actions[0], actions[-1]) if actions else None
+        with self._lock:
+            self._drop(name)
+            if len(actions) <= self.max_actions:
+                self._cache[name] = _Cached(path, _stamp(stat), digest, actions)
+                self._cached_actions += len(actions)
+                while self._cached_actions > self.max_actions:
+                    self._drop(next(iter(self._cache)))
+            self._store_entry(self._entry(name, path, file_format, stat, digest, len(actions), duration))
+        return actions
+
+    def _drop(self, name):
+        cached = self._cache.pop(name, None)
+        if cached is not None:
+            self._cached_actions -= len(cached.actions)
+
+    def cache_summary(self):
+        return (f"Recording cache: {len(self._cache)} recordings, {self._cached_actions} actions, "
+                f"{self.hits} hits, {self.misses} misses")
+
+
+if __name__ == "__main__":
+    catalog = RecordingCatalog()
+    catalog.refresh()
+    query = sys.argv[1] if len(sys.argv) > 1 else ""
+    for entry in catalog.search(query):
+        duration = f"{entry['duration']:.1f}s" if entry["duration"] is not None else "-"
+        print(f"{entry['name']:<30}{entry['format']:<6}{entry['actions']:>10} actions {duration:>10}  {entry['hash']}")
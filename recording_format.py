@@ -0,0 +1,184 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+# Compact recording layout (.arec), all little endian:
+#   header:  magic, version, record count, string table offset
+#   records: fixed-width rows of action code, string id, x, y, timestamp
+#   strings: count, then (length, utf-8 bytes) for every key/button name or wait fingerprint
+MAGIC = b'AREC'
+VERSION = 1
+HEADER = struct.Struct('<4sHxxIQ')
+RECORD = struct.Struct('<BxHiid')
+STRING_COUNT = struct.Struct('<I')
+STRING_LENGTH = struct.Struct('<H')
+
+ACTION_CODES = {"mouseDown": 1, "mouseUp": 2, "keyPress": 3, "mouseMove": 4, "waitStable": 5}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+BINARY_EXTENSION = ".arec"
+
+
+def write_recording(actions, path):
+    """ Write an iterable of action dicts to `path` in the compact format. Raises ValueError for
+    actions the format cannot hold; `path` is left untouched then. """
+    strings = {}
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            count = 0
+            for action in actions:
+                file.write(_pack_action(action, strings))
+                count += 1
+            string_offset = file.tell()
+            file.write(STRING_COUNT.pack(len(strings)))
+            for name in strings:
+                encoded = name.encode('utf-8')
+                if len(encoded) > 0xFFFF:
+                    raise ValueError(f"String of {len(encoded)} bytes is too long for the compact format")
+                file.write(STRING_LENGTH.pack(len(encoded)))
+                file.write(encoded)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, count, string_offset))
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return count
+
+
+def _pack_action(action, strings):
+    action_type = action.get("action")
+    code = ACTION_CODES.get(action_type)
+    if code is None:
+        raise ValueError(f"Action type {action_type!r} cannot be stored in the compact format")
+    if action_type == "keyPress":
+        name = action["key"]
+    elif action_type == "waitStable":
+        name = action.get("fingerprint") or ""
+    else:
+        name = action.get("button", "")
+    if not isinstance(name, str):
+        # e.g. a key pynput could not name
+        raise ValueError(f"{action_type} with {name!r} cannot be stored in the compact format")
+    string_id = strings.setdefault(name, len(strings))
+    if string_id > 0xFFFF:
+        # Every distinct key, button and wait fingerprint takes one id
+        raise ValueError(f"Recording has more than {0xFFFF + 1} distinct keys, buttons and fingerprints")
+    try:
+        # Some platforms report fractional mouse coordinates
+        return RECORD.pack(code, string_id, round(action.get("x", 0)), round(action.get("y", 0)),
+                           action.get("time", 0.0))
+    except (struct.error, TypeError) as e:
+        raise ValueError(f"Cannot store {action!r} in the compact format: {e}")
+
+
+class RecordingReader:
+    """ Memory-mapped view of a compact recording that decodes actions on demand. """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty")
+        try:
+            magic, version, self._count, string_offset = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a compact recording")
+            if HEADER.size + self._count * RECORD.size > string_offset:
+                raise ValueError(f"{path} is truncated")
+            self._strings = self._read_strings(string_offset)
+        except (struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise ValueError(f"{path} is truncated or not a compact recording: {e}")
+        except ValueError:
+            self.close()
+            raise
+
+    def _read_strings(self, offset):
+        (count,) = STRING_COUNT.unpack_from(self._map, offset)
+        offset += STRING_COUNT.size
+        strings = []
+        for _ in range(count):
+            (length,) = STRING_LENGTH.unpack_from(self._map, offset)
+            offset += STRING_LENGTH.size
+            if offset + length > len(self._map):
+                raise ValueError(f"{self.path} is truncated")
+            strings.append(self._map[offset:offset + length].decode('utf-8'))
+            offset += length
+        return strings
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("recording index out of range")
+        return self._decode(HEADER.size + index * RECORD.size)
+
+    def __iter__(self):
+        offset = HEADER.size
+        for _ in range(self._count):
+            yield self._decode(offset)
+            offset += RECORD.size
+
+    def _decode(self, offset):
+        code, string_id, x, y, timestamp = RECORD.unpack_from(self._map, offset)
+        action_type = ACTION_NAMES[code]
+        if action_type == "keyPress":
+            return {"action": action_type, "key": self._strings[string_id], "time": timestamp}
+        if action_type == "mouseMove":
+            return {"action": action_type, "x": x, "y": y, "time": timestamp}
+        if action_type == "waitStable":
+            action = {"action": action_type, "x": x, "y": y, "time": timestamp}
+            if self._strings[string_id]:
+                action["fingerprint"] = self._strings[string_id]
+            return action
+        return {"action": action_type, "x": x, "y": y, "button": self._strings[string_id], "time": timestamp}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def json_to_binary(json_path, binary_path):
+    """ Convert a JSON recording to the compact format. Returns the number of actions. """
+    with open(json_path, 'r') as f:
+        actions = json.load(f)
+    return write_recording(actions, binary_path)
+
+
+def binary_to_json(binary_path, json_path):
+    """ Convert a compact recording back to the JSON format. Returns the number of actions. """
+    reader = RecordingReader(binary_path)
+    try:
+        actions = list(reader)
+    finally:
+        reader.close()
+    with open(json_path, 'w') as f:
+        json.dump(actions, f, indent=4)
+    return len(actions)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python recording_format.py <input.json|input.arec> <output.arec|output.json>")
+        sys.exit(1)
+    source, destination = sys.argv[1], sys.argv[2]
+    if source.endswith(BINARY_EXTENSION):
+        converted = binary_to_json(source, destination)
+    else:
+        converted = json_to_binary(source, destination)
+    print(f"Converted {converted} actions from {source} to {destination}")
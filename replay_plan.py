@@ -0,0 +1,113 @@
+def _is_printable_key(action):
+    key = action.get("key")
+    return action.get("action") == "keyPress" and isinstance(key, str) and len(key) == 1 and key.isprintable()
+
+
+def raw_call_count(action):
+    """ Number of pyautogui calls the unoptimized replay makes for one action. """
+    if action.get("action") in ("mouseDown", "mouseUp"):
+        return 2  # moveTo followed by mouseDown/mouseUp
+    if action.get("action") == "waitStable":
+        return 0  # screen grabs only
+    return 1
+
+
+def plan_call_count(step):
+    """ Number of pyautogui calls the optimized replay makes for one plan step. """
+    if step.get("action") in ("mouseDown", "mouseUp") and step.get("move", True):
+        return 2
+    if step.get("action") == "waitStable":
+        return 0
+    return 1
+
+
+class ReplayOptimizer:
+    """ Rewrites a stream of recorded actions into a shorter replay plan.
+
+    - runs of printable keyPress actions become one typeText step
+    - a mouseDown immediately followed by a mouseUp at the same spot becomes one click step
+    - moves to where the pointer already is are dropped, and mouseDown/mouseUp steps are
+      marked with move=False when no moveTo is needed first
+
+    Every plan step carries 'count', the number of recorded actions it stands for, and the
+    optimizer counts primitive calls before and after so the saving can be reported.
+    """
+
+    def __init__(self):
+        self.raw_calls = 0
+        self.plan_calls = 0
+
+    @property
+    def removed_calls(self):
+        return self.raw_calls - self.plan_calls
+
+    def optimize(self, actions):
+        """ Lazily yield plan steps for `actions`. """
+        position = None
+        text, text_start, text_count = [], None, 0
+        pending_down = None
+
+        def flush_text():
+            if text:
+                step = {"action": "typeText", "text": "".join(text), "count": text_count}
+                if text_start is not None:
+                    step["time"] = text_start
+                text.clear()
+                return [step]
+            return []
+
+        for action in actions:
+            self.raw_calls += raw_call_count(action)
+            action_type = action.get("action")
+
+            if pending_down is not None:
+                if (action_type == "mouseUp" and action.get("x") == pending_down["x"]
+                        and action.get("y") == pending_down["y"] and action.get("button") == pending_down["button"]):
+                    step = {"action": "click", "x": pending_down["x"], "y": pending_down["y"],
+                            "button": pending_down["button"], "move": position != (pending_down["x"], pending_down["y"]),
+                            "count": 2}
+                    if "time" in pending_down:
+                        step["time"] = pending_down["time"]
+                    position = (step["x"], step["y"])
+                    pending_down = None
+                    yield from self._emit(step)
+                    continue
+                yield from self._emit(self._mouse_step(pending_down, position))
+                position = (pending_down["x"], pending_down["y"])
+                pending_down = None
+
+            if _is_printable_key(action):
+                if not text:
+                    text_start, text_count = action.get("time"), 0
+                text.append(action["key"])
+                text_count += action.get("count", 1)
+                continue
+            for step in flush_text():
+                yield from self._emit(step)
+
+            if action_type == "mouseDown":
+                pending_down = action
+            elif action_type == "mouseUp":
+                yield from self._emit(self._mouse_step(action, position))
+                position = (action["x"], action["y"])
+            elif action_type == "mouseMove":
+                if position == (action["x"], action["y"]):
+                    continue
+                position = (action["x"], action["y"])
+                yield from self._emit(action)
+            else:
+                yield from self._emit(action)
+
+        if pending_down is not None:
+            yield from self._emit(self._mouse_step(pending_down, position))
+        for step in flush_text():
+            yield from self._emit(step)
+
+    def _mouse_step(self, action, position):
+        step = dict(action)
+        step["move"] = position != (action["x"], action["y"])
+        return step
+
+    def _emit(self, step):
+        self.plan_calls += plan_call_count(step)
+        yield step
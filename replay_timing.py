@@ -0,0 +1,67 @@
+import time
+
+MODE_FIXED = "Fixed delay"
+MODE_RECORDED = "Recorded timing"
+MODE_FAST = "As fast as possible"
+REPLAY_MODES = (MODE_FIXED, MODE_RECORDED, MODE_FAST)
+
+
+def replay_schedule(actions, mode, delay=0.1, speed=1.0, max_gap=2.0):
+    """ Yield (action, offset) pairs, where offset is seconds after replay start the action is due.
+
+    Fixed delay spaces actions `delay` seconds apart. Recorded timing reuses the gaps
+    between recorded timestamps divided by `speed`, with each idle gap capped at
+    `max_gap` seconds before scaling, except that the gap before a waitStable step is
+    dropped because the wait itself replaces it. As fast as possible yields None so no
+    sleeping happens.
+    """
+    if mode == MODE_FAST:
+        for action in actions:
+            yield action, None
+        return
+    if mode == MODE_FIXED:
+        for index, action in enumerate(actions):
+            yield action, index * delay
+        return
+
+    speed = speed if speed > 0 else 1.0
+    offset = 0.0
+    previous_time = None
+    for action in actions:
+        recorded_time = action.get("time")
+        if previous_time is not None and recorded_time is not None and action.get("action") != "waitStable":
+            gap = min(max(recorded_time - previous_time, 0.0), max_gap)
+            offset += gap / speed
+        if recorded_time is not None:
+            previous_time = recorded_time
+        yield action, offset
+
+
+class DeadlineClock:
+    """ Sleep until absolute deadlines on the monotonic clock.
+
+    Every deadline is measured from the same start point, so an oversleep on one action
+    shortens the next wait instead of pushing the rest of the replay back.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.max_lateness = 0.0
+
+    def sleep_until(self, offset, stop_event=None):
+        """ Sleep until `offset` seconds after the start. Returns True, without waiting out the rest,
+        as soon as `stop_event` is set. """
+        deadline = self.start + offset
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            if stop_event is not None:
+                if stop_event.wait(remaining):
+                    return True
+            else:
+                time.sleep(remaining)
+        self.max_lateness = max(self.max_lateness, time.monotonic() - deadline)
+        return False
+
+    def shift(self, seconds):
+        """ Push every later deadline back, e.g. by the time spent paused. """
+        self.start += seconds
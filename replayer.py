@@ -0,0 +1,202 @@
+import threading
+import time
+
+import metrics
+import screen_wait
+from replay_timing import MODE_FIXED, MODE_RECORDED, DeadlineClock, replay_schedule
+from path_simplify import interpolate_moves
+from replay_plan import ReplayOptimizer
+
+DEFAULT_REPLAY_SETTINGS = {"mode": MODE_FIXED, "delay": 0.1, "speed": 1.0, "max_gap": 2.0, "optimize": True,
+                           "anchor": False}
+
+
+class ReplayControl:
+    """ Stop and pause for one replay. `pause_event` is set while paused, `stop_event` once stopped. """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.pause_event = threading.Event()
+        # Set whenever the replay may continue, so a paused replay blocks instead of polling
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        with self._lock:
+            self.stop_event.set()
+            self._resume_event.set()
+
+    def pause(self):
+        with self._lock:
+            if not self.stop_event.is_set():
+                self.pause_event.set()
+                self._resume_event.clear()
+
+    def resume(self):
+        with self._lock:
+            self.pause_event.clear()
+            self._resume_event.set()
+
+    def toggle_pause(self):
+        """ Pause or resume. Returns True if now paused. """
+        if self.pause_event.is_set():
+            self.resume()
+        else:
+            self.pause()
+        return self.pause_event.is_set()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def wait(self, seconds):
+        """ Sleep up to `seconds`, returning early (True) if stopped. """
+        return self.stop_event.wait(seconds)
+
+    def wait_while_paused(self):
+        """ Block until resumed or stopped. Returns the seconds spent paused. """
+        if self._resume_event.is_set():
+            return 0.0
+        paused_at = time.monotonic()
+        self._resume_event.wait()
+        return time.monotonic() - paused_at
+
+
+class Replayer:
+    """ Plays recorded actions back through pyautogui.
+
+    Holds no Tk state, so the same replayer serves the window and the headless daemon.
+    `on_progress(count)` is called with the number of recorded actions done so far.
+    """
+
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress
+        self._pyautogui = None
+
+    @property
+    def pyautogui(self):
+        # Imported on first replay so an idle daemon never loads the GUI automation stack
+        if self._pyautogui is None:
+            import pyautogui
+            self._pyautogui = pyautogui
+        return self._pyautogui
+
+    def replay(self, actions, settings=None, locator=None, control=None):
+        """ Replay `actions` on the calling thread until they run out or the ReplayControl is stopped.
+
+        With a visual_anchor.VisualLocator, clicks are moved to where their recorded patch is now.
+        Returns False if the replay was stopped before the end.
+        """
+        with metrics.registry.profiled("replay"):
+            return self._replay(actions, settings, locator, control or ReplayControl())
+
+    def _replay(self, actions, settings, locator, control):
+        settings = dict(DEFAULT_REPLAY_SETTINGS, **(settings or {}))
+        clock = DeadlineClock()
+        if settings["mode"] == MODE_RECORDED:
+            # Glide along recorded mouse paths instead of jumping between their vertices
+            actions = interpolate_moves(actions)
+        optimizer = None
+        if settings["optimize"]:
+            optimizer = ReplayOptimizer()
+            actions = optimizer.optimize(actions)
+        progress = 0
+        # Time spent waiting for deadlines vs. inside pyautogui, per action type
+        sleep_seconds = metrics.registry.histogram("replay_sleep_seconds")
+        input_seconds = {}
+        # Offset of an anchored mouseDown, applied to the rest of the drag until its mouseUp
+        anchor_offset = (0, 0)
+        schedule = replay_schedule(actions, settings["mode"], settings["delay"], settings["speed"],
+                                   settings["max_gap"])
+        completed = True
+        for action, offset in schedule:
+            if control.stopped:
+                completed = False
+                break
+            paused = control.wait_while_paused()
+            if paused:
+                clock.shift(paused)
+                if control.stopped:
+                    completed = False
+                    break
+            if offset is not None:
+                started = time.perf_counter()
+                stopped = clock.sleep_until(offset, control.stop_event)
+                sleep_seconds.observe(time.perf_counter() - started)
+                if stopped:
+                    completed = False
+                    break
+            started = time.perf_counter()
+            if locator is not None and "x" in action:
+                if action["action"] in ("mouseDown", "click"):
+                    x, y = locator.locate(action)
+                    anchor_offset = (x - action["x"], y - action["y"]) if action["action"] == "mouseDown" else (0, 0)
+                else:
+                    x, y = action["x"] + anchor_offset[0], action["y"] + anchor_offset[1]
+                    if action["action"] == "mouseUp":
+                        anchor_offset = (0, 0)
+                if (x, y) != (action["x"], action["y"]):
+                    action = dict(action, x=x, y=y, move=True)
+            waited = self.perform_action(action, control)
+            if waited:
+                # Later deadlines are measured from when the screen became ready
+                clock.shift(waited)
+            action_type = action["action"]
+            if action_type not in input_seconds:
+                input_seconds[action_type] = metrics.registry.histogram("replay_input_seconds", action=action_type)
+            input_seconds[action_type].observe(time.perf_counter() - started)
+            progress += action.get("count", 1)
+            if self.on_progress is not None:
+                self.on_progress(progress)
+        print(f"Replay finished, worst timing error {clock.max_lateness * 1000:.1f} ms")
+        metrics.registry.histogram("replay_max_lateness_seconds").observe(clock.max_lateness)
+        if locator is not None:
+            print(locator.summary())
+        if optimizer is not None:
+            print(f"Optimized replay: {optimizer.raw_calls} primitive calls reduced to {optimizer.plan_calls} "
+                  f"({optimizer.removed_calls} removed)")
+        return completed
+
+    def perform_action(self, action, control=None):
+        """ Perform one action. Returns the seconds spent waiting for a waitStable step, else None.
+        Stopping `control` ends a waitStable step early. """
+        action_type = action["action"]
+        if action_type == "waitStable":
+            expected = action.get("fingerprint")
+            ready, waited = screen_wait.wait_until_stable(action["x"], action["y"],
+                                                          bytes.fromhex(expected) if expected else None,
+                                                          timeout=action.get("timeout", screen_wait.WAIT_TIMEOUT),
+                                                          control=control)
+            if control is not None and control.stopped:
+                return waited
+            if not ready:
+                print(f"Screen near ({action['x']}, {action['y']}) was still changing after {waited:.1f}s, continuing")
+            return waited
+        pyautogui = self.pyautogui
+        if action_type == "mouseDown" or action_type == "mouseUp":
+            x, y = action["x"], action["y"]
+            button = action["button"]
+            self.perform_mouse_click(action_type, x, y, button, action.get("move", True))
+        elif action_type == "click":
+            if action.get("move", True):
+                pyautogui.click(action["x"], action["y"], button=action["button"])
+            else:
+                pyautogui.click(button=action["button"])
+        elif action_type == "mouseMove":
+            pyautogui.moveTo(action["x"], action["y"])
+        elif action_type == "keyPress":
+            key = action["key"]
+            pyautogui.press(key)
+        elif action_type == "typeText":
+            pyautogui.write(action["text"])
+
+    def perform_mouse_click(self, action_type, x, y, button, move=True):
+        pyautogui = self.pyautogui
+        button_str = button  # Button is already in string format
+        if move:
+            pyautogui.moveTo(x, y)
+        if action_type == "mouseDown":
+            pyautogui.mouseDown(button=button_str)
+        elif action_type == "mouseUp":
+            pyautogui.mouseUp(button=button_str)
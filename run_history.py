@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+
+# A year of history plus some slack
+DEFAULT_MAX_AGE_DAYS = 400
+# Percentiles and success rates per task look at this many of its most recent runs
+RECENT_RUNS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    task_name TEXT NOT NULL,
+    task_type TEXT NOT NULL,
+    repeat_index INTEGER NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_task_started ON runs (task_name, started);
+CREATE INDEX IF NOT EXISTS runs_status_started ON runs (status, started);
+CREATE INDEX IF NOT EXISTS runs_task_duration ON runs (task_name, duration);
+"""
+
+
+def _percentile(values, percent):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not values:
+        return None
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class RunHistory:
+    """ Every task repeat the app or daemon runs, in SQLite (run_history.db).
+
+    Writes come from task threads, so one connection is shared behind a lock. The queries
+    the window redraws from are bounded by index ranges or LIMITs, so they stay instant
+    however much history is kept.
+    """
+
+    def __init__(self, path="run_history.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            # WAL lets the daemon write while the window reads
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def record(self, task_name, task_type, repeat_index, started, duration, status, error=None):
+        """ Store one repeat. `started` is a Unix timestamp, `duration` is in seconds. Returns the row id. """
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs (task_name, task_type, repeat_index, started, duration, status, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_name, task_type, repeat_index, started, duration, status, error))
+            return cursor.lastrowid
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def last_id(self):
+        """ Id of the newest run, a cheap way to tell whether anything was added. """
+        return self._query("SELECT MAX(id) FROM runs")[0][0]
+
+    def last_runs(self, limit=20, task_name=None):
+        """ The newest runs first, as dicts. """
+        if task_name is None:
+            rows = self._query("SELECT * FROM runs ORDER BY started DESC LIMIT ?", (limit,))
+        else:
+            rows = self._query("SELECT * FROM runs WHERE task_name = ? ORDER BY started DESC LIMIT ?",
+                               (task_name, limit))
+        return [dict(row) for row in rows]
+
+    def success_rate(self, task_name=None, since=None):
+        """ Fraction of runs that succeeded (optionally for one task, since a Unix time), or None if there are none. """
+        where, parameters = self._filter(task_name, since)
+        total, succeeded = self._query(
+            f"SELECT COUNT(*), COALESCE(SUM(status = 'success'), 0) FROM runs {where}", parameters)[0]
+        return succeeded / total if total else None
+
+    def duration_percentiles(self, task_name, percentiles=(50, 95), since=None):
+        """ {percentile: seconds} over a task's runs, walking its (task_name, duration) index. """
+        where, parameters = self._filter(task_name, since)
+        count = self._query(f"SELECT COUNT(*) FROM runs {where}", parameters)[0][0]
+        result = {}
+        for percent in percentiles:
+            if not count:
+                result[percent] = None
+                continue
+            rank = min(max(int(round(percent / 100 * count + 0.5)) - 1, 0), count - 1)
+            result[percent] = self._query(f"SELECT duration FROM runs {where} ORDER BY duration LIMIT 1 OFFSET ?",
+                                          parameters + (rank,))[0][0]
+        return result
+
+    def task_summary(self, since=None):
+        """ Per task: runs, successes, success rate, mean duration and last start, over all runs since `since`. """
+        where, parameters = self._filter(None, since)
+        rows = self._query(
+            f"SELECT task_name, COUNT(*) AS runs, SUM(status = 'success') AS successes, "
+            f"AVG(duration) AS mean_duration, MAX(started) AS last_started FROM runs {where} "
+            f"GROUP BY task_name ORDER BY last_started DESC", parameters)
+        summary = [dict(row) for row in rows]
+        for entry in summary:
+            entry["success_rate"] = entry["successes"] / entry["runs"]
+        return summary
+
+    def recent_stats(self, task_name, limit=RECENT_RUNS):
+        """ Success rate and p50/p95 duration over a task's last `limit` runs, without scanning older history. """
+        rows = self._query("SELECT duration, status FROM runs WHERE task_name = ? ORDER BY started DESC LIMIT ?",
+                           (task_name, limit))
+        if not rows:
+            return None
+        durations = sorted(row["duration"] for row in rows)
+        return {
+            "runs": len(rows),
+            "success_rate": sum(row["status"] == 'success' for row in rows) / len(rows),
+            "p50": _percentile(durations, 50),
+            "p95": _percentile(durations, 95)
+        }
+
+    def prune(self, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        """ Delete runs older than `max_age_days`. Returns the number removed. """
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock, self._connection:
+            return self._connection.execute("DELETE FROM runs WHERE started < ?", (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _filter(task_name, since):
+        clauses, parameters = [], ()
+        if task_name is not None:
+            clauses.append("task_name = ?")
+            parameters += (task_name,)
+        if since is not None:
+            clauses.append("started >= ?")
+            parameters += (since,)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", parameters
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import threading
+import uuid
+from datetime import datetime
+
+
+class LatenessStats:
+    """ Running statistics for how late scheduled tasks fired. """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return {"count": self.count, "last": self.last, "mean": self.mean, "max": self.max}
+
+
+class TaskScheduler:
+    """ Priority queue of scheduled tasks keyed on their fire time.
+
+    Tasks are plain dicts with at least a 'time' datetime. Each task gets an 'id' when
+    added so it can be cancelled later. Cancelled entries are left in the heap and skipped
+    when they reach the top, so add and cancel are both O(log n).
+    """
+
+    def __init__(self, clock=datetime.now):
+        self.clock = clock
+        self.lateness = LatenessStats()
+        self._heap = []
+        self._tasks = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, task):
+        """ Add a task and return its id. Wakes anyone waiting on the schedule. """
+        with self._condition:
+            task_id = task.setdefault("id", uuid.uuid4().hex)
+            self._tasks[task_id] = task
+            heapq.heappush(self._heap, (task["time"], next(self._counter), task_id))
+            self._condition.notify_all()
+        return task_id
+
+    def cancel(self, task_id):
+        """ Remove a task by id. Returns the task, or None if it was not scheduled. """
+        with self._condition:
+            task = self._tasks.pop(task_id, None)
+            if task is not None:
+                self._compact()
+                self._condition.notify_all()
+            return task
+
+    def tasks(self):
+        """ Return the scheduled tasks ordered by fire time. """
+        with self._condition:
+            return sorted(self._tasks.values(), key=lambda task: task["time"])
+
+    def next_fire_time(self):
+        with self._condition:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def seconds_until_next(self):
+        """ Seconds until the next task is due (0 if overdue), or None if nothing is scheduled. """
+        fire_time = self.next_fire_time()
+        if fire_time is None:
+            return None
+        return max(0.0, (fire_time - self.clock()).total_seconds())
+
+    def pop_due(self):
+        """ Remove every task whose time has come and return (task, seconds late) pairs. """
+        due = []
+        with self._condition:
+            now = self.clock()
+            while True:
+                self._discard_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, task_id = heapq.heappop(self._heap)
+                task = self._tasks.pop(task_id)
+                lateness = (now - task["time"]).total_seconds()
+                self.lateness.record(lateness)
+                due.append((task, lateness))
+        return due
+
+    def wait(self, timeout=None):
+        """ Block until the next task is due, the schedule changes, or the timeout expires. """
+        with self._condition:
+            delay = self.seconds_until_next()
+            if delay is None:
+                delay = timeout
+            elif timeout is not None:
+                delay = min(delay, timeout)
+            if delay is None or delay > 0:
+                self._condition.wait(delay)
+
+    def wake(self):
+        """ Wake anyone blocked in wait(), e.g. so a shutting-down loop can notice its stop flag. """
+        with self._condition:
+            self._condition.notify_all()
+
+    def _discard_stale(self):
+        while self._heap:
+            fire_time, _, task_id = self._heap[0]
+            task = self._tasks.get(task_id)
+            if task is not None and task["time"] == fire_time:
+                return
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        # Rebuild the heap once cancelled entries outnumber live ones
+        if len(self._heap) > 2 * len(self._tasks) + 16:
+            self._heap = [entry for entry in self._heap if entry[2] in self._tasks]
+            heapq.heapify(self._heap)
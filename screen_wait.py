@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+# Side of the square region watched around a click, in pixels
+REGION_SIZE = 200
+# Regions are shrunk to this many pixels a side before comparing, so a check costs one small grab
+FINGERPRINT_SIZE = 16
+# Mean grey level difference below which two frames count as the same screen
+STABLE_TOLERANCE = 2.0
+# Mean grey level difference below which the region matches the recorded fingerprint
+MATCH_TOLERANCE = 6.0
+# How long the region must stay unchanged to count as stable, in seconds
+SETTLE_TIME = 0.3
+POLL_INTERVAL = 0.05
+WAIT_TIMEOUT = 30.0
+# Clicks this long after the previous click or key press get a wait step inserted before them
+AUTO_WAIT_PAUSE = 1.5
+
+
+def region_around(x, y, size=REGION_SIZE):
+    left, top = max(int(x) - size // 2, 0), max(int(y) - size // 2, 0)
+    return left, top, left + size, top + size
+
+
+def fingerprint(image, size=FINGERPRINT_SIZE):
+    """ Grey-level thumbnail of a PIL image as bytes, averaged down so noise and antialiasing wash out. """
+    from PIL import Image
+    return image.convert("L").resize((size, size), Image.BOX).tobytes()
+
+
+def grab_fingerprint(x, y, size=REGION_SIZE):
+    from PIL import ImageGrab
+    return fingerprint(ImageGrab.grab(bbox=region_around(x, y, size)))
+
+
+def difference(first, second):
+    """ Mean absolute grey level difference between two fingerprints. """
+    if len(first) != len(second):
+        return float("inf")
+    return sum(abs(a - b) for a, b in zip(first, second)) / len(first)
+
+
+def wait_until_stable(x, y, expected=None, timeout=WAIT_TIMEOUT, settle=SETTLE_TIME, poll_interval=POLL_INTERVAL,
+                      grab=grab_fingerprint, control=None):
+    """ Block until the region around (x, y) is ready. Returns (ready, seconds waited).
+
+    The region is ready when it matches the `expected` fingerprint, or when it has stayed
+    unchanged for `settle` seconds. With an expected fingerprint, a region that never
+    changed must stay unchanged for five times as long, since the page may not have
+    started loading yet. A stopped `control` (replayer.ReplayControl) ends the wait with
+    ready False; time spent paused does not count towards the timeout.
+    """
+    started = time.monotonic()
+    previous = grab(x, y)
+    stable_since = started
+    changed = False
+    paused_total = 0.0
+    while True:
+        now = time.monotonic()
+        if expected is not None and difference(previous, expected) <= MATCH_TOLERANCE:
+            return True, now - started
+        needed = settle if expected is None or changed else settle * 5
+        if now - stable_since >= needed:
+            return True, now - started
+        if now - started - paused_total >= timeout:
+            return False, now - started
+        if control is None:
+            time.sleep(poll_interval)
+        else:
+            if control.wait(poll_interval):
+                return False, time.monotonic() - started
+            paused = control.wait_while_paused()
+            if paused:
+                paused_total += paused
+                stable_since += paused
+                if control.stopped:
+                    return False, time.monotonic() - started
+        current = grab(x, y)
+        if difference(current, previous) > STABLE_TOLERANCE:
+            stable_since = time.monotonic()
+            changed = True
+        previous = current
+
+
+class FingerprintRecorder:
+    """ Fingerprints the region around requested clicks on a worker thread, keyed by click time. """
+
+    def __init__(self, grab=grab_fingerprint):
+        self.grab = grab
+        self.fingerprints = {}
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, x, y, action_time):
+        self._requests.put((x, y, action_time))
+
+    def stop(self):
+        """ Finish the pending grabs and return {action_time: fingerprint hex}. """
+        self._requests.put(None)
+        self._thread.join()
+        return self.fingerprints
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            x, y, action_time = request
+            try:
+                self.fingerprints[action_time] = self.grab(x, y).hex()
+            except Exception as e:
+                print(f"Failed to capture screen fingerprint: {e}")
@@ -0,0 +1,365 @@
+import array
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from task_store import atomic_write_json
+
+# Rows buffered from the first file of a partition to decide which columns are numeric
+TYPE_SAMPLE_ROWS = 200
+TICKER_COLUMNS = ("ticker", "symbol")
+DATE_IN_NAME = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+def parse_number(value):
+    """ Parse screener numbers such as "1,234.5" or "-2.31%". Returns NaN for blanks and text. """
+    value = value.strip().replace(",", "").rstrip("%")
+    if not value or value == "-":
+        return math.nan
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def _is_number(value):
+    value = value.strip()
+    return value in ("", "-") or not math.isnan(parse_number(value))
+
+
+def _column_file(name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+class _Partition:
+    """ One day of one source: a schema plus one file (or offsets + blob pair) per column,
+    and tickers.json mapping each ticker to its rows in this partition. """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.schema_path = self.directory / "schema.json"
+        self.tickers_path = self.directory / "tickers.json"
+        try:
+            with open(self.schema_path, 'r') as f:
+                self.schema = json.load(f)
+        except FileNotFoundError:
+            self.schema = {"columns": [], "types": {}, "rows": 0}
+        self._seen = None
+        self._tickers = None
+
+    @property
+    def rows(self):
+        return self.schema["rows"]
+
+    @property
+    def seen(self):
+        """ Digests of every row stored so far, used to skip rows that were already ingested. """
+        if self._seen is None:
+            self._seen = set()
+            try:
+                data = (self.directory / "seen.bin").read_bytes()
+                self._seen = {data[i:i + 8] for i in range(0, len(data), 8)}
+            except FileNotFoundError:
+                pass
+        return self._seen
+
+    @property
+    def tickers(self):
+        """ {ticker: [row, ...]} for the rows stored so far. """
+        if self._tickers is None:
+            try:
+                with open(self.tickers_path, 'r') as f:
+                    saved = json.load(f)
+            except FileNotFoundError:
+                saved = {}
+            # Rows past the schema's count belong to a batch that was never committed
+            rows = self.rows
+            self._tickers = {}
+            for ticker, positions in saved.items():
+                positions = [row for row in positions if row < rows]
+                if positions:
+                    self._tickers[ticker] = positions
+        return self._tickers
+
+    def add_column(self, name, column_type):
+        self.schema["columns"].append(name)
+        self.schema["types"][name] = column_type
+        # Leftovers from a crash before the schema was saved would misalign the column
+        base = self.directory / _column_file(name)
+        for suffix in (".f64", ".str", ".end"):
+            Path(f"{base}{suffix}").unlink(missing_ok=True)
+        # Backfill rows written before this column existed
+        self.append(name, [""] * self.rows if column_type == "str" else [math.nan] * self.rows)
+
+    def append(self, name, values):
+        base = self.directory / _column_file(name)
+        if self.schema["types"][name] == "num":
+            with open(f"{base}.f64", 'ab') as f:
+                array.array('d', values).tofile(f)
+            return
+        blob_path = Path(f"{base}.str")
+        offset = blob_path.stat().st_size if blob_path.exists() else 0
+        offsets = array.array('Q')
+        encoded = []
+        for value in values:
+            data = value.encode('utf-8')
+            encoded.append(data)
+            offset += len(data)
+            offsets.append(offset)
+        with open(blob_path, 'ab') as f:
+            f.write(b"".join(encoded))
+        with open(f"{base}.end", 'ab') as f:
+            offsets.tofile(f)
+
+    def read_column(self, name):
+        base = self.directory / _column_file(name)
+        if self.schema["types"][name] == "num":
+            values = array.array('d')
+            with open(f"{base}.f64", 'rb') as f:
+                values.frombytes(f.read())
+            return values
+        ends = array.array('Q')
+        with open(f"{base}.end", 'rb') as f:
+            ends.frombytes(f.read())
+        blob = Path(f"{base}.str").read_bytes()
+        values, start = [], 0
+        for end in ends:
+            values.append(blob[start:end].decode('utf-8'))
+            start = end
+        return values
+
+    def read_row(self, row, columns):
+        """ Read one row by seeking into each column file instead of loading whole columns. """
+        result = {}
+        for name in columns:
+            base = self.directory / _column_file(name)
+            if self.schema["types"][name] == "num":
+                with open(f"{base}.f64", 'rb') as f:
+                    f.seek(row * 8)
+                    result[name] = array.array('d', f.read(8))[0]
+            else:
+                with open(f"{base}.end", 'rb') as f:
+                    f.seek(max(row - 1, 0) * 8)
+                    bounds = array.array('Q', f.read(16 if row else 8))
+                start, end = (bounds[0], bounds[1]) if row else (0, bounds[0])
+                with open(f"{base}.str", 'rb') as f:
+                    f.seek(start)
+                    result[name] = f.read(end - start).decode('utf-8')
+        return result
+
+    def save(self, new_digests):
+        # Tickers before the schema, which commits the rows; entries past the committed row count are ignored
+        if self._tickers is not None:
+            atomic_write_json(self.tickers_path, self._tickers)
+        # Schema before seen.bin: after a crash in between, rows get re-ingested rather than lost
+        atomic_write_json(self.schema_path, self.schema)
+        with open(self.directory / "seen.bin", 'ab') as f:
+            f.write(b"".join(new_digests))
+
+    def repair(self):
+        """ Cut column files back to the row count in the schema, dropping a half-written batch. """
+        rows = self.rows
+        for name in self.schema["columns"]:
+            base = self.directory / _column_file(name)
+            if self.schema["types"][name] == "num":
+                paths = [(Path(f"{base}.f64"), rows * 8)]
+            else:
+                ends = Path(f"{base}.end")
+                blob_size = 0
+                if rows and ends.exists() and ends.stat().st_size >= rows * 8:
+                    with open(ends, 'rb') as f:
+                        f.seek((rows - 1) * 8)
+                        blob_size = array.array('Q', f.read(8))[0]
+                paths = [(ends, rows * 8), (Path(f"{base}.str"), blob_size)]
+            for path, size in paths:
+                if path.exists() and path.stat().st_size > size:
+                    with open(path, 'r+b') as f:
+                        f.truncate(size)
+
+
+class ScreenerStore:
+    """ Typed columnar store of Finviz/TradingView screener exports, partitioned by source and date.
+
+    Layout: <root>/<source>/<YYYY-MM-DD>/ holds schema.json, one .f64 file per numeric column,
+    a .str blob plus .end offsets per text column, and tickers.json with each ticker's rows.
+    <root>/ticker_partitions.jsonl gets one line per ingest listing the tickers new to that
+    partition, so history queries open only the partitions holding a ticker, and an ingest
+    appends to the index instead of rewriting it.
+    CSVs are parsed a row at a time and rows already stored for that day are skipped.
+    """
+
+    def __init__(self, root="screener_data", batch_rows=5000):
+        self.root = Path(root)
+        self.batch_rows = batch_rows
+        self.index_path = self.root / "ticker_partitions.jsonl"
+        # Written by earlier versions: {ticker: [[source, date, row], ...]}
+        self.legacy_index_path = self.root / "ticker_index.json"
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def ticker_index(self):
+        """ {ticker: [[source, date], ...]} of the partitions each ticker appears in. """
+        if self._index is None:
+            if self.legacy_index_path.exists():
+                self._migrate_legacy_index()
+            index = {}
+            try:
+                with open(self.index_path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # A line cut short by a crash
+                            continue
+                        for ticker in entry["tickers"]:
+                            index.setdefault(ticker, []).append([entry["source"], entry["date"]])
+            except FileNotFoundError:
+                pass
+            self._index = index
+        return self._index
+
+    def _add_to_index(self, source, date, tickers):
+        if not tickers:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, 'a') as f:
+            f.write(json.dumps({"source": source, "date": date, "tickers": tickers}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _migrate_legacy_index(self):
+        with open(self.legacy_index_path, 'r') as f:
+            legacy = json.load(f)
+        partitions = {}
+        for ticker, locations in legacy.items():
+            for source, date, row in locations:
+                partitions.setdefault((source, date), {}).setdefault(ticker, []).append(row)
+        for (source, date), tickers in partitions.items():
+            partition = _Partition(self.root / source / date)
+            # Drop rows from the old index that the partition never committed
+            tickers = {ticker: [row for row in rows if row < partition.rows] for ticker, rows in tickers.items()}
+            tickers = {ticker: rows for ticker, rows in tickers.items() if rows}
+            atomic_write_json(partition.tickers_path, tickers)
+            self._add_to_index(source, date, sorted(tickers))
+        self.legacy_index_path.unlink()
+
+    def ingest(self, csv_path, source=None, date=None):
+        """ Append a screener CSV to the store. Returns the number of new rows stored. """
+        csv_path = Path(csv_path)
+        source = source or csv_path.parent.name
+        if date is None:
+            match = DATE_IN_NAME.search(csv_path.name)
+            date = match.group(1) if match else datetime.fromtimestamp(csv_path.stat().st_mtime).strftime("%Y-%m-%d")
+        with self._lock:
+            partition_dir = self.root / source / date
+            partition_dir.mkdir(parents=True, exist_ok=True)
+            partition = _Partition(partition_dir)
+            partition.repair()
+            with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
+                return self._ingest_rows(partition, csv.reader(f), source, date)
+
+    def _ingest_rows(self, partition, reader, source, date):
+        header = next(reader, None)
+        if not header:
+            return 0
+        header = [name.strip() for name in header]
+        sample = []
+        for row in reader:
+            sample.append(row)
+            if len(sample) >= TYPE_SAMPLE_ROWS:
+                break
+        for position, name in enumerate(header):
+            if name not in partition.schema["types"]:
+                values = [row[position] if position < len(row) else "" for row in sample]
+                partition.add_column(name, "num" if values and all(_is_number(v) for v in values) else "str")
+        ticker_position = next((header.index(name) for name in header if name.lower() in TICKER_COLUMNS), None)
+
+        def rows():
+            yield from sample
+            yield from reader
+
+        added = 0
+        batch, digests = [], []
+        # Tickers seen in this partition for the first time; only indexed once the rows are committed
+        new_tickers = []
+        for row in rows():
+            digest = hashlib.blake2b("\x1f".join(row).encode('utf-8'), digest_size=8).digest()
+            if digest in partition.seen:
+                continue
+            partition.seen.add(digest)
+            digests.append(digest)
+            values = dict(zip(header, row))
+            batch.append(values)
+            if ticker_position is not None and ticker_position < len(row):
+                ticker = row[ticker_position].strip().upper()
+                if ticker not in partition.tickers:
+                    partition.tickers[ticker] = []
+                    new_tickers.append(ticker)
+                partition.tickers[ticker].append(partition.rows + len(batch) - 1)
+            added += 1
+            if len(batch) >= self.batch_rows:
+                self._write_batch(partition, batch)
+                batch = []
+        if batch:
+            self._write_batch(partition, batch)
+        # Listed before the commit: a partition listed for a ticker it never stored is harmless,
+        # since its tickers.json only covers committed rows
+        self._add_to_index(source, date, new_tickers)
+        partition.save(digests)
+        for ticker in new_tickers:
+            self.ticker_index.setdefault(ticker, []).append([source, date])
+        return added
+
+    def _write_batch(self, partition, batch):
+        for name in partition.schema["columns"]:
+            if partition.schema["types"][name] == "num":
+                partition.append(name, [parse_number(row.get(name, "")) for row in batch])
+            else:
+                partition.append(name, [row.get(name, "") for row in batch])
+        partition.schema["rows"] += len(batch)
+
+    def dates(self, source):
+        source_dir = self.root / source
+        return sorted(p.name for p in source_dir.iterdir() if p.is_dir()) if source_dir.exists() else []
+
+    def ticker_history(self, ticker, columns=None):
+        """ Every stored row for a ticker, oldest first, as dicts with 'source' and 'date' added. """
+        history = []
+        partitions = {}
+        ticker = ticker.upper()
+        for source, date in self.ticker_index.get(ticker, []):
+            key = (source, date)
+            if key in partitions:
+                continue
+            partition = partitions[key] = _Partition(self.root / source / date)
+            for row in partition.tickers.get(ticker, []):
+                record = partition.read_row(row, columns or partition.schema["columns"])
+                record.update({"source": source, "date": date})
+                history.append(record)
+        history.sort(key=lambda record: record["date"])
+        return history
+
+    def screen_on_date(self, source, date, where=None, columns=None):
+        """ Rows stored for `source` on `date`, optionally filtered by `where(row_dict)`. """
+        partition_dir = self.root / source / date
+        if not partition_dir.exists():
+            return []
+        partition = _Partition(partition_dir)
+        columns = columns or partition.schema["columns"]
+        needed = list(columns)
+        if where is not None:
+            needed = partition.schema["columns"]
+        data = {name: partition.read_column(name) for name in needed}
+        results = []
+        for row in range(partition.rows):
+            record = {name: data[name][row] for name in needed}
+            if where is None or where(record):
+                results.append({name: record[name] for name in columns})
+        return results
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime
+
+# The window should be on screen well within this many seconds of launch
+STARTUP_TARGET = 0.5
+
+
+class StartupTimer:
+    """ Records how long each startup phase took, measured from when the timer was created. """
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self._last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        """ End the current phase, naming it `phase`. """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def elapsed(self):
+        return self._last - self.start
+
+    def report(self, first_frame_phase=None):
+        """ A printable breakdown of the startup phases and their share of the total. """
+        total = self.elapsed
+        lines = [f"Startup took {total * 1000:.0f} ms:"]
+        for phase, seconds in self.phases:
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"  {phase:<28}{seconds * 1000:8.1f} ms {share:5.1f}%")
+        if first_frame_phase is not None:
+            first_frame = sum(seconds for _, seconds in self.phases[:self._index(first_frame_phase) + 1])
+            verdict = "within" if first_frame <= STARTUP_TARGET else "over"
+            lines.append(f"  Window shown after {first_frame * 1000:.0f} ms "
+                         f"({verdict} the {STARTUP_TARGET * 1000:.0f} ms target)")
+        return "\n".join(lines)
+
+    def _index(self, phase):
+        return [name for name, _ in self.phases].index(phase)
+
+    def save(self, path="startup_times.log", first_frame_phase=None):
+        """ Append the report to a log file, since the packaged build has no console. """
+        try:
+            with open(path, 'a') as f:
+                f.write(f"{datetime.now():%Y-%m-%d %H:%M:%S} {self.report(first_frame_phase)}\n")
+        except OSError as e:
+            print(f"Failed to save startup times: {e}")
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# Number of journal entries written before the snapshot is rewritten
+COMPACT_EVERY = 200
+
+
+def recording_id(actions):
+    """ Return a content hash identifying a list of recorded actions. """
+    encoded = json.dumps(actions, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def atomic_write_json(path, data):
+    """ Write JSON to a temp file beside `path` and rename it into place. """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ScheduleLock:
+    """ Lock on a file beside the task store, held by the one process that runs the schedule.
+
+    The daemon and a window started without it both take it before loading tasks, so two
+    processes never fire the same tasks or write the same journal. The OS drops the lock when
+    its holder exits, so a crash leaves nothing to clean up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """ Take the lock without waiting. Returns False if another process holds it. """
+        if self._file is not None:
+            return True
+        file = open(self.path, 'a+')
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        # The holder's pid, for anyone wondering who owns the schedule
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self._file = file
+        return True
+
+    def owner(self):
+        """ Pid written by the last holder, or None. """
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._file is not None:
+            # Closing the file releases the lock on every platform
+            self._file.close()
+            self._file = None
+
+
+class TaskStore:
+    """ Persist scheduled tasks as a compact snapshot plus an append-only journal.
+
+    Each recording is stored once under a content hash and tasks refer to it by
+    'recording_id', so scheduling the same actions many times costs one small
+    journal line per task. The snapshot is rewritten atomically every
+    COMPACT_EVERY journal entries; replaying the journal is idempotent, so a
+    crash at any point leaves a readable store.
+    """
+
+    def __init__(self, path="scheduled_tasks.json", compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self.compact_every = compact_every
+        self.tasks = {}
+        self.recordings = {}
+        self.journal_entries = 0
+
+    def load(self):
+        """ Read the snapshot, replay the journal and return the tasks with their actions resolved. """
+        self.tasks = {}
+        self.recordings = {}
+        migrated = self._load_snapshot()
+        self.journal_entries, torn = self._replay_journal()
+        if migrated or torn or self.journal_entries >= self.compact_every:
+            self.compact()
+        return [self._resolve(record) for record in self.tasks.values()]
+
+    def add_task(self, task):
+        """ Journal a new task. The task must already have an 'id'. """
+        actions = task.get('actions', [])
+        rec_id = recording_id(actions)
+        entries = []
+        if rec_id not in self.recordings:
+            self.recordings[rec_id] = actions
+            entries.append({"op": "recording", "id": rec_id, "actions": actions})
+        record = self._to_record(task, rec_id)
+        self.tasks[record['id']] = record
+        entries.append({"op": "add", "task": record})
+        self._append(entries)
+
+    def remove_task(self, task_id):
+        """ Journal the removal of a task that has fired or been cancelled. """
+        if self.tasks.pop(task_id, None) is not None:
+            self._append([{"op": "remove", "id": task_id}])
+
+    def compact(self):
+        """ Atomically rewrite the snapshot from memory and empty the journal. """
+        used = {record['recording_id'] for record in self.tasks.values()}
+        self.recordings = {rec_id: actions for rec_id, actions in self.recordings.items() if rec_id in used}
+        atomic_write_json(self.path, {
+            "version": 2,
+            "recordings": self.recordings,
+            "tasks": list(self.tasks.values())
+        })
+        with open(self.journal_path, 'w'):
+            pass
+        self.journal_entries = 0
+
+    def _append(self, entries):
+        lines = "".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in entries)
+        with open(self.journal_path, 'a') as journal:
+            journal.write(lines)
+            journal.flush()
+            os.fsync(journal.fileno())
+        self.journal_entries += len(entries)
+        if self.journal_entries >= self.compact_every:
+            self.compact()
+
+    def _load_snapshot(self):
+        """ Load the snapshot. Returns True if it was in the old inline format and needs rewriting. """
+        try:
+            with open(self.path, 'r') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return False
+        if not content.strip():
+            return False
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON: {e}")
+            return False
+
+        if isinstance(data, list):
+            # Old format: a list of tasks, each with its own copy of the actions
+            for index, task in enumerate(data):
+                task.setdefault('id', f"legacy-{index}")
+                rec_id = recording_id(task.get('actions', []))
+                self.recordings.setdefault(rec_id, task.get('actions', []))
+                record = {key: value for key, value in task.items() if key != 'actions'}
+                record['recording_id'] = rec_id
+                self.tasks[record['id']] = record
+            return True
+
+        self.recordings = data.get("recordings", {})
+        for record in data.get("tasks", []):
+            self.tasks[record['id']] = record
+        return False
+
+    def _replay_journal(self):
+        """ Apply the journal to memory. Returns (entries applied, whether a torn entry was found). """
+        count = 0
+        try:
+            with open(self.journal_path, 'r') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-append; everything before it is intact
+                        print(f"Ignoring incomplete journal entry in {self.journal_path}")
+                        return count, True
+                    self._apply(entry)
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count, False
+
+    def _apply(self, entry):
+        op = entry.get("op")
+        if op == "recording":
+            self.recordings[entry["id"]] = entry["actions"]
+        elif op == "add":
+            self.tasks[entry["task"]["id"]] = entry["task"]
+        elif op == "remove":
+            self.tasks.pop(entry["id"], None)
+
+    def _to_record(self, task, rec_id):
+        record = {key: value for key, value in task.items() if key != 'actions'}
+        record['time'] = task['time'].isoformat()
+        record['recording_id'] = rec_id
+        return record
+
+    def _resolve(self, record):
+        task = dict(record)
+        task['time'] = datetime.fromisoformat(record['time'])
+        task['actions'] = self.recordings.get(record['recording_id'], [])
+        return task
@@ -0,0 +1,231 @@
+import collections
+import os
+import queue
+import threading
+import time
+
+# Anchors for recordings/<task>.json live next to it in recordings/<task>.anchors.npz
+ANCHOR_EXTENSION = ".anchors.npz"
+# Side of the square patch captured around each click, in pixels
+PATCH_SIZE = 32
+# How far from the recorded spot a target may have moved and still be found
+SEARCH_RADIUS = 120
+# Each level halves the resolution; the full search runs on the coarsest one
+PYRAMID_LEVELS = 2
+# Normalized cross-correlation a match needs before the click is moved
+MATCH_THRESHOLD = 0.8
+# Patches with less contrast than this (grey level std) match anywhere, so they are not used
+MIN_PATCH_STD = 4.0
+CACHE_SIZE = 64
+
+
+def _numpy():
+    # NumPy is only needed once anchoring is switched on
+    import numpy
+    return numpy
+
+
+def anchor_key(action_time):
+    """ Anchors are keyed on the recorded time of their mouseDown, which survives both file formats. """
+    return f"{action_time:.6f}"
+
+
+def anchors_path(task_name, directory="recordings"):
+    return os.path.join(directory, f"{task_name}{ANCHOR_EXTENSION}")
+
+
+def grab_region(left, top, width, height):
+    """ Grey-level screenshot of one region as a float32 array, plus the left/top it actually starts at. """
+    from PIL import ImageGrab
+    np = _numpy()
+    left, top = max(int(left), 0), max(int(top), 0)
+    image = ImageGrab.grab(bbox=(left, top, left + int(width), top + int(height)))
+    return np.asarray(image.convert("L"), dtype=np.float32), left, top
+
+
+def downscale(image):
+    """ Halve an image by averaging 2x2 blocks. """
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return image.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+
+
+def ncc_map(region, patch):
+    """ Normalized cross-correlation of `patch` at every position in `region` (top-left aligned). """
+    np = _numpy()
+    windows = np.lib.stride_tricks.sliding_window_view(region, patch.shape)
+    count = patch.size
+    centred = patch - patch.mean()
+    patch_norm = np.sqrt((centred * centred).sum())
+    sums = windows.sum(axis=(2, 3))
+    squares = np.einsum('ijkl,ijkl->ij', windows, windows)
+    cross = np.einsum('ijkl,kl->ij', windows, centred)
+    window_norm = np.sqrt(np.maximum(squares - sums * sums / count, 0))
+    return cross / (window_norm * patch_norm + 1e-6)
+
+
+def find_patch(screen, patch, expected, radius=SEARCH_RADIUS, levels=PYRAMID_LEVELS, threshold=MATCH_THRESHOLD):
+    """ Find `patch` in `screen` near `expected`, the (x, y) its centre was recorded at.
+
+    Only a region of interest `radius` pixels around the expected spot is searched. The
+    exhaustive search runs on a downscaled pyramid level, and each finer level only
+    re-checks a few pixels around the coarse hit. Returns (x, y, score) of the matched
+    centre in screen coordinates, or None if nothing scores `threshold` or better.
+    """
+    np = _numpy()
+    patch = np.asarray(patch, dtype=np.float32)
+    screen = np.asarray(screen, dtype=np.float32)
+    if patch.std() < MIN_PATCH_STD:
+        return None
+    patch_height, patch_width = patch.shape
+    left = int(expected[0]) - patch_width // 2
+    top = int(expected[1]) - patch_height // 2
+    x0, y0 = max(left - radius, 0), max(top - radius, 0)
+    x1 = min(left + radius + patch_width, screen.shape[1])
+    y1 = min(top + radius + patch_height, screen.shape[0])
+    if x1 - x0 < patch_width or y1 - y0 < patch_height:
+        return None
+
+    regions, patches = [screen[y0:y1, x0:x1]], [patch]
+    for _ in range(levels):
+        smaller = downscale(patches[-1])
+        if min(smaller.shape) < 4 or smaller.std() < MIN_PATCH_STD / 2:
+            break
+        patches.append(smaller)
+        regions.append(downscale(regions[-1]))
+
+    scores = ncc_map(regions[-1], patches[-1])
+    best_y, best_x = np.unravel_index(np.argmax(scores), scores.shape)
+    score = scores[best_y, best_x]
+    for level in range(len(patches) - 2, -1, -1):
+        region, level_patch = regions[level], patches[level]
+        # Refine within +-2 pixels of the coarse hit at twice the resolution
+        sx, sy = max(best_x * 2 - 2, 0), max(best_y * 2 - 2, 0)
+        sub = region[sy:sy + level_patch.shape[0] + 4, sx:sx + level_patch.shape[1] + 4]
+        scores = ncc_map(sub, level_patch)
+        dy, dx = np.unravel_index(np.argmax(scores), scores.shape)
+        best_x, best_y, score = sx + dx, sy + dy, scores[dy, dx]
+    if score < threshold:
+        return None
+    return int(x0 + best_x + patch_width // 2), int(y0 + best_y + patch_height // 2), float(score)
+
+
+class AnchorSet(dict):
+    """ Image patch (uint8 array) per anchor_key, saved as a compressed .npz next to the recording. """
+
+    def save(self, path):
+        np = _numpy()
+        # Written to a temporary file first so a crash never leaves half an archive
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(temp_path, **self)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        np = _numpy()
+        with np.load(path) as data:
+            return cls((key, data[key]) for key in data.files)
+
+
+class PatchRecorder:
+    """ Grabs a patch around each click on a worker thread, so the pynput listener never blocks. """
+
+    def __init__(self, patch_size=PATCH_SIZE, grab=grab_region):
+        self.patch_size = patch_size
+        self.grab = grab
+        self.anchors = AnchorSet()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, x, y, action_time):
+        self._requests.put((x, y, action_time))
+
+    def stop(self):
+        """ Finish the pending grabs and return the anchors collected. """
+        self._requests.put(None)
+        self._thread.join()
+        return self.anchors
+
+    def _run(self):
+        np = _numpy()
+        half = self.patch_size // 2
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            x, y, action_time = request
+            x, y = int(x), int(y)
+            try:
+                patch, left, top = self.grab(x - half, y - half, self.patch_size, self.patch_size)
+                # Clicks near the screen edge give clipped patches, which cannot be centred on the click
+                if patch.shape == (self.patch_size, self.patch_size) and (left, top) == (x - half, y - half):
+                    self.anchors[anchor_key(action_time)] = patch.astype(np.uint8)
+            except Exception as e:
+                print(f"Failed to capture click anchor: {e}")
+
+
+class VisualLocator:
+    """ Moves clicks to where their recorded patch is on screen now.
+
+    The offset found for each anchor is cached, so when the layout has not changed since
+    the last replay only a few pixels around the cached spot are checked.
+    """
+
+    def __init__(self, anchors, radius=SEARCH_RADIUS, levels=PYRAMID_LEVELS, threshold=MATCH_THRESHOLD,
+                 cache_size=CACHE_SIZE, grab=grab_region):
+        self.anchors = anchors
+        self.radius = radius
+        self.levels = levels
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.grab = grab
+        self._cache = collections.OrderedDict()
+        self.cache_hits = 0
+        self.searches = 0
+        self.misses = 0
+        self.search_seconds = 0.0
+
+    def locate(self, action):
+        """ (x, y) to click for a recorded mouseDown/click, falling back to the recorded spot. """
+        x, y = action["x"], action["y"]
+        key = anchor_key(action["time"]) if "time" in action else None
+        patch = self.anchors.get(key)
+        if patch is None:
+            return x, y
+        started = time.perf_counter()
+        try:
+            offset = self._cache.get(key)
+            if offset is not None:
+                found = self._search(patch, x + offset[0], y + offset[1], radius=2, levels=0)
+                if found is not None:
+                    self.cache_hits += 1
+                    self._cache.move_to_end(key)
+                    return found
+            self.searches += 1
+            found = self._search(patch, x, y, self.radius, self.levels)
+            if found is None:
+                self.misses += 1
+                return x, y
+            self._cache[key] = (found[0] - x, found[1] - y)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return found
+        except Exception as e:
+            print(f"Visual anchoring failed, clicking the recorded spot: {e}")
+            return x, y
+        finally:
+            self.search_seconds += time.perf_counter() - started
+
+    def _search(self, patch, x, y, radius, levels):
+        size = patch.shape[1] + 2 * radius, patch.shape[0] + 2 * radius
+        screen, left, top = self.grab(x - size[0] // 2, y - size[1] // 2, size[0], size[1])
+        found = find_patch(screen, patch, (x - left, y - top), radius, levels, self.threshold)
+        if found is None:
+            return None
+        return left + found[0], top + found[1]
+
+    def summary(self):
+        return (f"Anchored clicks: {self.cache_hits} cached, {self.searches} searched, {self.misses} not found, "
+                f"{self.search_seconds * 1000:.1f} ms spent")